@@ -1,12 +1,35 @@
 from django.contrib import admin
 
+from posts import search
+from posts.paginators import EstimatedCountPaginator
+
 from .models import Comment, Group, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist для больших таблиц: без точных COUNT(*) и с поиском по
+    полнотекстовому индексу search_table.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_table = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.search_table is None:
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_matching(queryset, search_term, self.search_table), False
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
     search_fields = ("text",)
+    search_table = search.POSTS_TABLE
     list_filter = ("pub_date", "group")
+    date_hierarchy = "pub_date"
+    raw_id_fields = ("author",)
     empty_value_display = "-пусто-"
 
 
@@ -14,10 +37,15 @@ class GroupAdmin(admin.ModelAdmin):
     list_display = ("title", "description", "slug")
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ("post", "text", "author", "created")
+    list_select_related = ("post", "author")
     search_fields = ("text",)
+    search_table = search.COMMENTS_TABLE
     list_filter = ("created",)
+    date_hierarchy = "created"
+    ordering = ("-created", "-id")
+    raw_id_fields = ("post", "author", "parent")
 
 
 admin.site.register(Post, PostAdmin)
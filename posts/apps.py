@@ -1,5 +1,16 @@
+import atexit
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PostsConfig(AppConfig):
     name = "posts"
+
+    def ready(self):
+        from posts import signals  # noqa
+        from posts import view_counts
+
+        # Под тестами база к выходу уже удалена, сбрасывать некуда
+        if not settings.TESTING:
+            atexit.register(view_counts.flush)
@@ -0,0 +1,460 @@
+import datetime as dt
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
+
+from posts.models import Group, ReactionCounter, User
+from yatube.routers import use_primary
+
+GENERATION_KEY = "page_generation:{}"
+GENERATION_TIME_KEY = "page_generation:{}:time"
+REFRESH_KEY = "page_generation:{}:refresh"
+REFRESH_PENDING_KEY = "page_generation:{}:pending"
+PAGE_KEY = "page:{view}:{generations}:{viewer}:{path}"
+STALE_PAGE_KEY = "page_stale:{view}:{viewer}:{path}"
+LOCK_KEY = "page_lock:{}"
+LOCK_POLL_INTERVAL = 0.05
+GLOBAL_SCOPE = "global"
+
+
+def new_generation():
+    # Начальное значение зависит от времени, чтобы после потери счетчика
+    # не совпасть с поколением, под которым уже лежат старые страницы
+    return time.time_ns()
+
+
+def get_generations(scopes):
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    refresh_keys = {
+        scope: (REFRESH_KEY.format(scope), REFRESH_PENDING_KEY.format(scope))
+        for scope in scopes
+    }
+    found = cache.get_many(
+        keys + [key for pair in refresh_keys.values() for key in pair]
+    )
+    due = [
+        scope
+        for scope, (refresh, pending) in refresh_keys.items()
+        if pending in found and refresh not in found
+    ]
+    if due:
+        refreshed = refresh_scopes(due)
+        found.update(
+            cache.get_many([GENERATION_KEY.format(scope) for scope in refreshed])
+        )
+    for scope, key in zip(scopes, keys):
+        if key not in found:
+            cache.add(key, new_generation(), None)
+            # Страница могла поменяться когда угодно до нового поколения
+            cache.add(GENERATION_TIME_KEY.format(scope), time.time(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump_generations(*scopes):
+    scopes = set(scopes)
+    for scope in scopes:
+        key = GENERATION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), None)
+    now = time.time()
+    cache.set_many({GENERATION_TIME_KEY.format(scope): now for scope in scopes}, None)
+
+
+def refresh_scopes(scopes):
+    """
+    Сбрасывает поколения областей, у которых кончилось окно
+    PAGE_COUNTER_REFRESH, и возвращает сброшенные.
+    """
+    window = settings.PAGE_COUNTER_REFRESH
+    refreshed = [
+        scope for scope in scopes if cache.add(REFRESH_KEY.format(scope), 1, window)
+    ]
+    if refreshed:
+        cache.delete_many([REFRESH_PENDING_KEY.format(scope) for scope in refreshed])
+        bump_generations(*refreshed)
+    return refreshed
+
+
+def schedule_refresh(*scopes):
+    """
+    Сбрасывает поколения из-за счетчиков не чаще раза в PAGE_COUNTER_REFRESH.
+
+    Внутри окна область только помечается, и ее поколение сбросит первый
+    запрос страницы после конца окна - так последнее изменение счетчика
+    не застревает в кеше до следующей правки.
+    """
+    scopes = set(scopes)
+    postponed = scopes - set(refresh_scopes(scopes))
+    cache.set_many(
+        {REFRESH_PENDING_KEY.format(scope): 1 for scope in postponed},
+        settings.PAGE_CACHE_TIMEOUT,
+    )
+
+
+def generations_modified(scopes):
+    """
+    Когда последний раз менялось поколение любой из областей.
+    """
+    times = cache.get_many([GENERATION_TIME_KEY.format(scope) for scope in scopes])
+    if len(times) < len(scopes):
+        return None
+    return dt.datetime.fromtimestamp(max(times.values()), tz=timezone.utc)
+
+
+def recently_modified(scopes):
+    modified = generations_modified(scopes)
+    window = dt.timedelta(seconds=settings.DATABASE_STICKY_SECONDS)
+    return modified is not None and timezone.now() - modified < window
+
+
+def should_refresh(entry):
+    """
+    Вероятностное раннее устаревание (XFetch): чем ближе срок и чем дольше
+    строилось значение, тем вероятнее его пересоберут заранее, поэтому
+    ключи не истекают все в одну секунду.
+    """
+    beta = settings.PAGE_CACHE_EARLY_EXPIRY_BETA
+    jitter = -entry["delta"] * beta * math.log(1 - random.random())
+    return time.time() + jitter >= entry["expires"]
+
+
+def rebuild(key, stale_key, build, timeout, cacheable):
+    started = time.time()
+    value = build()
+    if cacheable(value):
+        entry = {
+            "value": value,
+            "delta": time.time() - started,
+            "built": started,
+            "expires": started + timeout,
+            "stale_until": started + timeout + settings.PAGE_CACHE_GRACE,
+        }
+        cache.set(key, entry, timeout)
+        cache.set(stale_key, entry, timeout + settings.PAGE_CACHE_GRACE)
+    return value
+
+
+def within_grace(entry, changed_at):
+    """
+    Можно ли еще отдавать прошлую версию: не дольше PAGE_CACHE_GRACE после
+    ее срока или после изменения, которое ее заменило (changed_at).
+    """
+    now = time.time()
+    # У записей, сохраненных до появления срока, его нет - их не отдаем
+    if now >= entry.get("stale_until", 0):
+        return False
+    if changed_at is None or changed_at <= entry.get("built", 0):
+        return True
+    return now < changed_at + settings.PAGE_CACHE_GRACE
+
+
+def get_or_rebuild(
+    key,
+    stale_key,
+    build,
+    timeout,
+    cacheable=lambda value: True,
+    changed_at=lambda: None,
+):
+    """
+    Отдает значение из кеша, пересобирая его только в одном запросе.
+
+    Пока один запрос держит блокировку и строит значение, остальные
+    получают прошлую версию из stale_key, если она устарела не больше
+    PAGE_CACHE_GRACE назад, а иначе ждут готового значения не дольше
+    PAGE_CACHE_LOCK_WAIT. changed_at возвращает время изменения, после
+    которого прошлая версия устарела, или None.
+    """
+    entry = cache.get(key)
+    if entry is not None and not should_refresh(entry):
+        return entry["value"]
+
+    lock_key = LOCK_KEY.format(stale_key)
+    if cache.add(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+        try:
+            return rebuild(key, stale_key, build, timeout, cacheable)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is None:
+        entry = cache.get(stale_key)
+        if entry is not None and not within_grace(entry, changed_at()):
+            entry = None
+    deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_WAIT
+    while entry is None and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+    if entry is None:
+        return build()
+    return entry["value"]
+
+
+def page_viewer(request):
+    """
+    Часть ключа страницы, зависящая от зрителя. Страницы вошедшего
+    пользователя содержат CSRF-токен, поэтому зависят и от его cookie.
+    """
+    if not request.user.is_authenticated:
+        return "0"
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    return "{}-{}".format(
+        request.user.pk, hashlib.md5(csrf_cookie.encode()).hexdigest()[:8]
+    )
+
+
+def viewer_scope(user_id):
+    return f"viewer:{user_id}"
+
+
+def viewer_scopes(request):
+    """
+    Своя область у каждого вошедшего: ее сброс обновляет страницы только
+    для него, например после его же лайка, пока остальные ждут окна
+    PAGE_COUNTER_REFRESH.
+    """
+    if not request.user.is_authenticated:
+        return []
+    return [viewer_scope(request.user.pk)]
+
+
+def cached_page(scopes, timeout=None):
+    """
+    Кеширует страницу под ключом из поколений ее областей.
+
+    Страница живет в кеше долго, а устаревает только когда сигнал
+    увеличит поколение одной из областей. Пересобирает ее один запрос,
+    остальные в это время получают прошлую версию.
+    """
+    if timeout is None:
+        timeout = settings.PAGE_CACHE_TIMEOUT
+
+    def cacheable(response):
+        return response.status_code == 200 and not response.streaming
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            page_scopes = [
+                GLOBAL_SCOPE,
+                *viewer_scopes(request),
+                *scopes(request, *args, **kwargs),
+            ]
+            generations = get_generations(page_scopes)
+            names = {
+                "view": view.__name__,
+                "viewer": page_viewer(request),
+                "path": hashlib.md5(request.get_full_path().encode()).hexdigest(),
+            }
+            key = PAGE_KEY.format(
+                generations=".".join(str(generation) for generation in generations),
+                **names,
+            )
+
+            def build():
+                # Реплика могла еще не получить изменение, из-за которого
+                # сбросилось поколение, а собранная из нее страница осела бы
+                # в кеше надолго
+                if recently_modified(page_scopes):
+                    with use_primary():
+                        return view(request, *args, **kwargs)
+                return view(request, *args, **kwargs)
+
+            def changed_at():
+                modified = generations_modified(page_scopes)
+                return modified.timestamp() if modified else None
+
+            return get_or_rebuild(
+                key,
+                STALE_PAGE_KEY.format(**names),
+                build,
+                timeout,
+                cacheable,
+                changed_at,
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def conditional_page(scopes, validators):
+    """
+    Отвечает 304 Not Modified, не строя страницу, если она не менялась.
+
+    validators одним запросом к базе возвращает кортеж значений, от которых
+    зависит страница, или None, если объекта нет. ETag складывается из них,
+    поколений областей и зрителя, Last-Modified - из дат в кортеже и
+    времени последнего сброса поколений.
+    """
+
+    def decorator(view):
+        def compute(request, *args, **kwargs):
+            if not hasattr(request, "page_validators"):
+                row = validators(*args, **kwargs)
+                request.page_validators = (None, None)
+                if row is not None:
+                    page_scopes = [
+                        GLOBAL_SCOPE,
+                        *viewer_scopes(request),
+                        *scopes(request, *args, **kwargs),
+                    ]
+                    etag = hashlib.md5(
+                        repr(
+                            (
+                                view.__name__,
+                                page_viewer(request),
+                                get_generations(page_scopes),
+                                row,
+                            )
+                        ).encode()
+                    ).hexdigest()
+                    dates = [value for value in row if isinstance(value, dt.datetime)]
+                    modified = generations_modified(page_scopes)
+                    last_modified = max(dates + [modified]) if modified else None
+                    request.page_validators = (etag, last_modified)
+            return request.page_validators
+
+        return condition(
+            etag_func=lambda *args, **kwargs: compute(*args, **kwargs)[0],
+            last_modified_func=lambda *args, **kwargs: compute(*args, **kwargs)[1],
+        )(view)
+
+    return decorator
+
+
+def index_scope():
+    return "index"
+
+
+def group_scope(slug):
+    return f"group:{slug}"
+
+
+def profile_scope(username):
+    return f"profile:{username}"
+
+
+def post_page_scopes(posts, *group_ids):
+    """
+    Области страниц, на которых выводятся записи posts.
+    """
+    posts = list(posts)
+    group_ids = {*(post.group_id for post in posts), *group_ids} - {None}
+    slugs = Group.objects.filter(pk__in=group_ids).values_list("slug", flat=True)
+    authors = User.objects.filter(
+        pk__in={post.author_id for post in posts}
+    ).values_list("username", flat=True)
+    return [
+        index_scope(),
+        *(group_scope(slug) for slug in slugs),
+        *(profile_scope(username) for username in authors),
+    ]
+
+
+def invalidate_post_pages(post, *group_ids):
+    bump_generations(*post_page_scopes([post], *group_ids))
+
+
+def refresh_post_pages(posts):
+    """
+    Обновляет страницы после изменения счетчиков записей, с задержкой.
+    """
+    posts = list(posts)
+    if posts:
+        schedule_refresh(*post_page_scopes(posts))
+
+
+def invalidate_profiles(*user_ids):
+    usernames = User.objects.filter(pk__in=user_ids).values_list("username", flat=True)
+    bump_generations(*(profile_scope(username) for username in usernames))
+
+
+LIKES_KEY = "post_likes:{}"
+POST_CARD_KEY = "post_card:{id}:{version}"
+POST_CARD_TEMPLATE = "include/post_card_static.html"
+VIEWER_ACTIONS_MARKER = "<!-- viewer-actions -->"
+
+
+def post_card_key(post):
+    # В ключ входит все, что выводит карточка: правка записи меняет updated,
+    # новый комментарий - счетчик, переименование группы - ее название
+    version = hashlib.md5(
+        "|".join(
+            str(value)
+            for value in (
+                post.updated.timestamp() if post.updated else "",
+                post.comments_count,
+                post.author.username,
+                post.group.slug if post.group else "",
+                post.group.title if post.group else "",
+                post.image_variants,
+            )
+        ).encode()
+    ).hexdigest()
+    return POST_CARD_KEY.format(id=post.id, version=version)
+
+
+def render_post_card(post):
+    html = render_to_string(POST_CARD_TEMPLATE, {"post": post})
+    head, _, tail = html.partition(VIEWER_ACTIONS_MARKER)
+    return head, tail
+
+
+def attach_post_cards(posts):
+    """
+    Подставляет в записи готовый HTML карточек одним запросом к кешу.
+    """
+    posts = list(posts)
+    keys = {post_card_key(post): post for post in posts}
+    cards = cache.get_many(keys)
+    rendered = {}
+    for key, post in keys.items():
+        if key not in cards:
+            cards[key] = rendered[key] = render_post_card(post)
+        post.card = tuple(mark_safe(part) for part in cards[key])
+    if rendered:
+        cache.set_many(rendered, settings.POST_CARD_CACHE_TIMEOUT)
+    totals = like_totals([post.id for post in posts])
+    for post in posts:
+        post.likes = totals[post.id]
+    return posts
+
+
+def like_totals(post_ids):
+    """
+    Число реакций на записи из кеша, недостающие - суммой шардов одним запросом.
+    """
+    keys = {LIKES_KEY.format(post_id): post_id for post_id in post_ids}
+    found = cache.get_many(keys)
+    totals = {keys[key]: total for key, total in found.items()}
+    missing = [post_id for key, post_id in keys.items() if key not in found]
+    if missing:
+        summed = dict.fromkeys(missing, 0)
+        summed.update(
+            ReactionCounter.objects.filter(post__in=missing)
+            .values("post")
+            .annotate(total=Sum("count"))
+            .values_list("post", "total")
+        )
+        cache.set_many(
+            {LIKES_KEY.format(post_id): total for post_id, total in summed.items()},
+            settings.REACTION_TOTAL_TIMEOUT,
+        )
+        totals.update(summed)
+    return totals
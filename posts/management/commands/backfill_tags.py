@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import tags
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Индексирует хештеги и упоминания в уже опубликованных записях"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="Записей за один проход"
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.order_by("pk").only("pk", "text", "pub_date")
+        last_pk, indexed = 0, 0
+        while True:
+            chunk = list(posts.filter(pk__gt=last_pk)[: options["chunk_size"]])
+            if not chunk:
+                break
+            tags.reindex_posts(chunk)
+            last_pk = chunk[-1].pk
+            indexed += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано записей: {indexed}"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = "Переносит счетчики популярности в текущую эпоху и удаляет остывшие"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Пересчитать счетчики заново по записям и комментариям",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            posts, groups = trending.rebuild()
+            self.stdout.write(f"Пересчитано записей: {posts}, групп: {groups}")
+        moved, deleted = trending.compact()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Перенесено счетчиков: {moved}, удалено остывших: {deleted}"
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import suggestions
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рекомендации авторов по графу подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engine",
+            choices=sorted(suggestions.ENGINES),
+            help="scipy, если установлен, иначе python",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=suggestions.REBUILD_CHUNK_SIZE,
+            help="Сколько пользователей считать за раз",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            users = suggestions.rebuild(options["engine"], options["chunk_size"])
+        except ImportError as error:
+            raise CommandError(str(error))
+        self.stdout.write(
+            self.style.SUCCESS(f"Рекомендации посчитаны для пользователей: {users}")
+        )
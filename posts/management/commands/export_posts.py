@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import dump_record, export_records
+
+
+class Command(BaseCommand):
+    help = "Выгружает пользователей, группы, записи, комментарии и подписки в JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default="-", help="Файл или - для stdout"
+        )
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            exported = self.export(self.stdout._out)
+        else:
+            with open(options["path"], "w", encoding="utf-8") as stream:
+                exported = self.export(stream)
+        self.stderr.write(self.style.SUCCESS(f"Выгружено строк: {exported}"))
+
+    def export(self, stream):
+        exported = 0
+        for record in export_records():
+            stream.write(dump_record(record) + "\n")
+            exported += 1
+        return exported
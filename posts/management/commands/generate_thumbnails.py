@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import generate_thumbnails
+
+
+def generate_one(post):
+    post_id, image_name = post
+    try:
+        generate_thumbnails(image_name, [post_id])
+    except Exception as error:
+        return image_name, str(error)
+    return image_name, None
+
+
+class Command(BaseCommand):
+    help = "Строит миниатюры и адаптивные варианты изображений записей"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(), help="Число процессов"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=32, help="Файлов на одну задачу"
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Только записи без адаптивных вариантов",
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image="").exclude(image__isnull=True)
+        if options["missing"]:
+            posts = posts.filter(image_variants="")
+        images = list(posts.order_by("pk").values_list("pk", "image").iterator())
+        # Дочерние процессы откроют свои соединения, родительские не наследуем
+        connections.close_all()
+
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            results = executor.map(
+                generate_one, images, chunksize=options["chunk_size"]
+            )
+            for image_name, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{image_name}: {error}")
+                else:
+                    done += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Миниатюр готово: {done}, с ошибками: {failed}")
+        )
@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+from posts.transfer import ImportConflict, Importer
+
+
+class Command(BaseCommand):
+    help = "Загружает выгрузку export_posts пачками с возможностью продолжить"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл JSONL")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Строк в одной транзакции"
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Начать сначала, даже если есть сохраненная позиция",
+        )
+        parser.add_argument(
+            "--no-rebuild",
+            action="store_true",
+            help="Не пересчитывать счетчики, ленты, рекомендации, теги и поисковый индекс",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл {path} не найден")
+        checkpoint = f"{path}.offset"
+        offset = 0
+        if os.path.exists(checkpoint) and not options["restart"]:
+            with open(checkpoint) as checkpoint_file:
+                offset = int(checkpoint_file.read() or 0)
+            self.stdout.write(f"Продолжаю с позиции {offset}")
+
+        importer = Importer(options["batch_size"])
+        with open(path, "rb") as source:
+            source.seek(offset)
+            model_name, batch = None, []
+            for line in iter(source.readline, b""):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if batch and (
+                    record["model"] != model_name or len(batch) >= importer.batch_size
+                ):
+                    self.load_batch(importer, model_name, batch)
+                    self.save_checkpoint(checkpoint, source.tell() - len(line))
+                    batch = []
+                model_name = record.pop("model")
+                batch.append(record)
+            if batch:
+                self.load_batch(importer, model_name, batch)
+        importer.finish()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        if not options["no_rebuild"]:
+            call_command("reconcile_counters", stdout=self.stdout)
+            call_command("rebuild_timelines", stdout=self.stdout)
+            call_command("compute_follow_suggestions", stdout=self.stdout)
+            call_command("backfill_tags", stdout=self.stdout)
+            if search.is_available():
+                call_command("rebuild_search_index", stdout=self.stdout)
+        loaded = ", ".join(
+            f"{name}: {count}" for name, count in importer.counts.items()
+        )
+        self.stdout.write(self.style.SUCCESS(f"Загружено строк - {loaded}"))
+
+    def load_batch(self, importer, model_name, batch):
+        try:
+            importer.load_batch(model_name, batch)
+        except ImportConflict as error:
+            raise CommandError(str(error))
+
+    def save_checkpoint(self, checkpoint, offset):
+        with open(f"{checkpoint}.tmp", "w") as checkpoint_file:
+            checkpoint_file.write(str(offset))
+        os.replace(f"{checkpoint}.tmp", checkpoint)
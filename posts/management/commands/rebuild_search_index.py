@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Пересобирает полнотекстовый индекс записей и комментариев"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("Полнотекстовый индекс есть только в SQLite")
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Проиндексировано записей: {Post.objects.count()}, "
+                f"комментариев: {Comment.objects.count()}"
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import timelines
+from posts.models import Follow
+
+
+class Command(BaseCommand):
+    help = "Пересобирает материализованные ленты подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Только эти пользователи")
+        parser.add_argument(
+            "--pending-authors",
+            action="store_true",
+            help="Только дозаполнить ленты авторами, которых больше не читают напрямую",
+        )
+
+    def handle(self, *args, **options):
+        if options["pending_authors"]:
+            authors = timelines.backfill_pending_authors()
+            self.stdout.write(self.style.SUCCESS(f"Дозаполнено авторов: {authors}"))
+            return
+
+        followers = Follow.objects.values_list("user_id", flat=True).distinct()
+        if options["usernames"]:
+            followers = followers.filter(user__username__in=options["usernames"])
+        rebuilt = 0
+        for user_id in followers.iterator():
+            timelines.rebuild_timeline(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Пересобрано лент: {rebuilt}"))
@@ -0,0 +1,127 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.cache import bump_generations, group_scope, post_page_scopes, profile_scope
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+
+BATCH_SIZE = 1000
+
+
+def count_subquery(queryset, field):
+    counted = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = "Сверяет денормализованные счетчики с реальными данными"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Только показать расхождения"
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        # Области страниц с исправленными счетчиками: закешированные страницы
+        # иначе показывали бы старые числа до следующей правки
+        self.scopes = set()
+        posts_fixed = self.reconcile_posts(dry_run)
+        groups_fixed = self.reconcile_groups(dry_run)
+        users_fixed = self.reconcile_users(dry_run)
+        if self.scopes and not dry_run:
+            bump_generations(*self.scopes)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Записей с расхождениями: {posts_fixed}, "
+                f"групп с расхождениями: {groups_fixed}, "
+                f"пользователей с расхождениями: {users_fixed}"
+            )
+        )
+
+    def reconcile_posts(self, dry_run):
+        drifted = (
+            Post.objects.annotate(actual=count_subquery(Comment.objects, "post"))
+            .exclude(comments_count=F("actual"))
+            .values_list("pk", "actual")
+        )
+        batch, fixed = [], 0
+        for pk, actual in drifted.iterator():
+            batch.append(Post(pk=pk, comments_count=actual))
+            fixed += 1
+            if len(batch) >= BATCH_SIZE:
+                self.save_post_batch(batch, dry_run)
+                batch = []
+        self.save_post_batch(batch, dry_run)
+        return fixed
+
+    def save_post_batch(self, batch, dry_run):
+        if not batch:
+            return
+        self.save_batch(Post, batch, ["comments_count"], dry_run)
+        posts = Post.objects.filter(pk__in=[post.pk for post in batch])
+        self.scopes.update(post_page_scopes(posts.only("author", "group")))
+
+    def reconcile_groups(self, dry_run):
+        drifted = [
+            Group(pk=pk, posts_count=actual)
+            for pk, actual in Group.objects.annotate(
+                actual=count_subquery(Post.objects, "group")
+            )
+            .exclude(posts_count=F("actual"))
+            .values_list("pk", "actual")
+        ]
+        self.save_batch(Group, drifted, ["posts_count"], dry_run)
+        slugs = Group.objects.filter(
+            pk__in=[group.pk for group in drifted]
+        ).values_list("slug", flat=True)
+        self.scopes.update(group_scope(slug) for slug in slugs)
+        return len(drifted)
+
+    def reconcile_users(self, dry_run):
+        fields = ["posts_count", "followers_count", "following_count"]
+        actual = User.objects.annotate(
+            posts_count=count_subquery(Post.objects, "author"),
+            followers_count=count_subquery(Follow.objects, "author"),
+            following_count=count_subquery(Follow.objects, "user"),
+        ).values_list("pk", *fields)
+        batch, fixed = [], 0
+        for row in actual.iterator():
+            pk, counts = row[0], dict(zip(fields, row[1:]))
+            batch.append(UserStats(user_id=pk, **counts))
+            if len(batch) >= BATCH_SIZE:
+                fixed += self.save_user_batch(batch, fields, dry_run)
+                batch = []
+        fixed += self.save_user_batch(batch, fields, dry_run)
+        return fixed
+
+    def save_user_batch(self, batch, fields, dry_run):
+        stored = UserStats.objects.in_bulk([stats.user_id for stats in batch])
+        missing = [stats for stats in batch if stats.user_id not in stored]
+        drifted = [
+            stats
+            for stats in batch
+            if stats.user_id in stored
+            and any(
+                getattr(stats, field) != getattr(stored[stats.user_id], field)
+                for field in fields
+            )
+        ]
+        if not dry_run:
+            UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+        self.save_batch(UserStats, drifted, fields, dry_run)
+        usernames = User.objects.filter(
+            pk__in=[stats.user_id for stats in missing + drifted]
+        ).values_list("username", flat=True)
+        self.scopes.update(profile_scope(username) for username in usernames)
+        return len(missing) + len(drifted)
+
+    def save_batch(self, model, batch, fields, dry_run):
+        if batch and not dry_run:
+            model.objects.bulk_update(batch, fields, batch_size=BATCH_SIZE)
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0007_auto_20200829_1231"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="post",
+            options={"ordering": ["-pub_date", "-id"]},
+        ),
+    ]
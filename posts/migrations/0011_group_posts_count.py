@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:23
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_group_counters(apps, schema_editor):
+    Group = apps.get_model("posts", "Group")
+    Post = apps.get_model("posts", "Post")
+    counted = (
+        Post.objects.filter(group=OuterRef("pk"))
+        .order_by()
+        .values("group")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Group.objects.update(
+        posts_count=Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0010_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="posts_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_group_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:24
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model("posts", "Follow")
+    UserStats = apps.get_model("posts", "UserStats")
+    duplicates = (
+        Follow.objects.values("user", "author")
+        .annotate(first_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        Follow.objects.filter(
+            user=duplicate["user"], author=duplicate["author"]
+        ).exclude(pk=duplicate["first_id"]).delete()
+        UserStats.objects.filter(user=duplicate["user"]).update(
+            following_count=Follow.objects.filter(user=duplicate["user"]).count()
+        )
+        UserStats.objects.filter(user=duplicate["author"]).update(
+            followers_count=Follow.objects.filter(author=duplicate["author"]).count()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0011_group_posts_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "created", "id"], name="comment_post_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-pub_date", "-id"], name="post_feed_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["author", "-pub_date", "-id"], name="post_author_feed_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["group", "-pub_date", "-id"], name="post_group_feed_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="follow",
+            constraint=models.UniqueConstraint(
+                fields=("user", "author"), name="unique_follow"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0012_feed_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="updated",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                verbose_name="date updated",
+            ),
+            preserve_default=False,
+        ),
+    ]
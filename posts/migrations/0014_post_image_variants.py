@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0013_post_updated"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="image_variants",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+    ]
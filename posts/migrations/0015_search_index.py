@@ -0,0 +1,41 @@
+from django.db import migrations
+
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+        f"USING fts5(text, tokenize = '{TOKENIZER}')"
+    )
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_comment_fts "
+        f"USING fts5(text, post_id UNINDEXED, tokenize = '{TOKENIZER}')"
+    )
+    schema_editor.execute(
+        "INSERT INTO posts_post_fts (rowid, text) SELECT id, text FROM posts_post"
+    )
+    schema_editor.execute(
+        "INSERT INTO posts_comment_fts (rowid, text, post_id) "
+        "SELECT id, text, post_id FROM posts_comment"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS posts_post_fts")
+    schema_editor.execute("DROP TABLE IF EXISTS posts_comment_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0014_post_image_variants"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0015_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(fields=["-created", "-id"], name="comment_created_idx"),
+        ),
+    ]
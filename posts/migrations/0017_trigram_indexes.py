@@ -0,0 +1,39 @@
+from django.db import migrations
+
+TRIGRAM_INDEXES = (
+    ("post_text_trgm_idx", "posts_post"),
+    ("comment_text_trgm_idx", "posts_comment"),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # icontains в поиске и админке на PostgreSQL превращается в ILIKE '%...%',
+    # который без триграмм читает всю таблицу
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {table} USING gin (text gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("posts", "0016_comment_created_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
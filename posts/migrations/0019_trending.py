@@ -0,0 +1,71 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0018_follow_suggestions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GroupTrend",
+            fields=[
+                (
+                    "group",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trend",
+                        serialize=False,
+                        to="posts.Group",
+                    ),
+                ),
+                ("epoch", models.PositiveIntegerField()),
+                ("score", models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PostTrend",
+            fields=[
+                (
+                    "post",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trend",
+                        serialize=False,
+                        to="posts.Post",
+                    ),
+                ),
+                ("epoch", models.PositiveIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "group",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="posts.Group",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="grouptrend",
+            index=models.Index(fields=["epoch", "-score"], name="group_trend_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="posttrend",
+            index=models.Index(fields=["epoch", "-score"], name="post_trend_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="posttrend",
+            index=models.Index(
+                fields=["group", "epoch", "-score"], name="post_trend_group_idx"
+            ),
+        ),
+    ]
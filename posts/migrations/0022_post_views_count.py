@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0021_reactions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="views_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.6 on 2026-10-18 03:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0011_update_proxy_permissions"),
+        ("posts", "0023_tags_and_mentions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OnReadAuthor",
+            fields=[
+                (
+                    "author",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("backfill_pending", models.BooleanField(default=False)),
+            ],
+        ),
+    ]
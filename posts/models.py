@@ -1,22 +1,55 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import models
-
+from django.db.models.functions import Greatest
 
 User = get_user_model()
 
 
-class Group(models.Model):
+class CounterFieldsMixin:
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        # Счетчики меняются только атомарным UPDATE, не затираем их при правке
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CounterFieldsMixin, models.Model):
     slug = models.SlugField(unique=True)
     title = models.CharField(max_length=200, unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ("posts_count",)
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def bump(cls, group_id, delta):
+        if group_id is not None:
+            cls.objects.filter(pk=group_id).update(
+                posts_count=Greatest(models.F("posts_count") + delta, 0)
+            )
 
-class Post(models.Model):
+
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        return self.select_related("author", "group")
+
+
+class Post(CounterFieldsMixin, models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
+    updated = models.DateTimeField("date updated", auto_now=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
     group = models.ForeignKey(
         Group,
@@ -26,24 +59,334 @@ class Post(models.Model):
         blank=True,
     )
     image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    image_variants = models.TextField(blank=True, default="", editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    views_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    counter_fields = ("comments_count", "views_count")
 
     class Meta:
-        ordering = ["-pub_date", "author"]
+        ordering = ["-pub_date", "-id"]
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"], name="post_feed_idx"),
+            models.Index(
+                fields=["author", "-pub_date", "-id"], name="post_author_feed_idx"
+            ),
+            models.Index(
+                fields=["group", "-pub_date", "-id"], name="post_group_feed_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.text
 
+    @property
+    def image_srcsets(self):
+        variants = json.loads(self.image_variants or "[]")
+        srcsets = {}
+        for variant in sorted(variants, key=lambda variant: variant["width"]):
+            url = default_storage.url(variant["name"])
+            srcsets.setdefault(variant["format"], []).append(
+                f"{url} {variant['width']}w"
+            )
+        return {image_format: ", ".join(urls) for image_format, urls in srcsets.items()}
+
+    @property
+    def image_fallback_url(self):
+        variants = [
+            variant
+            for variant in json.loads(self.image_variants or "[]")
+            if variant["format"] == "jpeg"
+        ]
+        if variants:
+            largest = max(variants, key=lambda variant: variant["width"])
+            return default_storage.url(largest["name"])
+        return ""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_group_id = instance.__dict__.get("group_id")
+        return instance
+
+
+# Ширина сегмента пути: id комментария, дополненный нулями, чтобы
+# строковый порядок путей совпадал с порядком обхода дерева
+PATH_SEGMENT = 10
+
+
+class CommentQuerySet(models.QuerySet):
+    def roots(self):
+        return self.filter(depth=0)
+
+    def subtrees(self, comments):
+        """
+        Ответы на comments одним запросом по диапазонам путей, в порядке дерева.
+        """
+        ranges = models.Q()
+        for comment in comments:
+            ranges |= models.Q(path__gt=comment.path, path__lt=comment.path + "~")
+        if not ranges:
+            return self.none()
+        return self.filter(ranges).order_by("path")
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        related_name="children",
+        null=True,
+        blank=True,
+    )
+    # Пути предков и свой id, по PATH_SEGMENT символов на уровень
+    path = models.CharField(max_length=255, blank=True, default="", editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    replies_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["post", "created", "id"], name="comment_post_created_idx"
+            ),
+            models.Index(fields=["-created", "-id"], name="comment_created_idx"),
+            models.Index(
+                fields=["post", "depth", "created", "id"], name="comment_post_root_idx"
+            ),
+            models.Index(fields=["post", "path"], name="comment_post_path_idx"),
+        ]
 
     def __str__(self):
         return self.text
 
+    def reply_to(self, parent, max_depth):
+        # Глубже max_depth ответ становится соседом, а не потомком
+        while parent is not None and parent.depth >= max_depth:
+            parent = parent.parent
+        self.parent = parent
+
+    def path_ids(self):
+        return [
+            int(self.path[start : start + PATH_SEGMENT])
+            for start in range(0, len(self.path), PATH_SEGMENT)
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id is not None:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if not self.path:
+            parent_path = self.parent.path if self.parent_id else ""
+            self.path = f"{parent_path}{self.pk:0{PATH_SEGMENT}d}"
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "author"], name="unique_follow"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"], name="unique_timeline_entry"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-post"], name="timeline_user_feed_idx"
+            ),
+            models.Index(fields=["user", "author"], name="timeline_user_author_idx"),
+        ]
+
+
+class OnReadAuthor(models.Model):
+    """
+    Автор, чьи записи лента подписок читает напрямую. backfill_pending -
+    автор из этого множества вышел, но ленты подписчиков еще не дозаполнены.
+    """
+
+    author = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    backfill_pending = models.BooleanField(default=False)
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def actual_counts(cls, user_id):
+        return {
+            "posts_count": Post.objects.filter(author=user_id).count(),
+            "followers_count": Follow.objects.filter(author=user_id).count(),
+            "following_count": Follow.objects.filter(user=user_id).count(),
+        }
+
+    @classmethod
+    def for_user(cls, user):
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            stats, _ = cls.objects.get_or_create(
+                user=user, defaults=cls.actual_counts(user.pk)
+            )
+            return stats
+
+    @classmethod
+    def bump(cls, user_id, **deltas):
+        changes = {
+            field: Greatest(models.F(field) + delta, 0)
+            for field, delta in deltas.items()
+        }
+        if not cls.objects.filter(user=user_id).update(**changes):
+            if all(delta > 0 for delta in deltas.values()):
+                cls.objects.get_or_create(
+                    user_id=user_id, defaults=cls.actual_counts(user_id)
+                )
+
+
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="follow_suggestions"
+    )
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "author"], name="unique_follow_suggestion"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-score"], name="suggestion_user_score_idx"),
+        ]
+
+
+class PostTrend(models.Model):
+    # score хранится как сумма w·e^{λ(t - начало эпохи)}: вес события со
+    # временем не пересчитывается, порядок внутри эпохи сохраняется сам
+    post = models.OneToOneField(
+        Post, on_delete=models.CASCADE, primary_key=True, related_name="trend"
+    )
+    group = models.ForeignKey(
+        Group, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    epoch = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["epoch", "-score"], name="post_trend_idx"),
+            models.Index(
+                fields=["group", "epoch", "-score"], name="post_trend_group_idx"
+            ),
+        ]
+
+
+class GroupTrend(models.Model):
+    group = models.OneToOneField(
+        Group, on_delete=models.CASCADE, primary_key=True, related_name="trend"
+    )
+    epoch = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["epoch", "-score"], name="group_trend_idx"),
+        ]
+
+
+class Reaction(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reactions")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="reactions")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "post"], name="unique_reaction"),
+        ]
+
+
+class ReactionCounter(models.Model):
+    # Сумма по всем шардам - число реакций на запись. Запись идет в случайный
+    # шард, поэтому лайки популярной записи не выстраиваются в очередь за
+    # одной строкой
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="reaction_counters"
+    )
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "shard"], name="unique_reaction_counter_shard"
+            ),
+        ]
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class PostTag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="post_tags")
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="post_tags")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tag", "post"], name="unique_post_tag"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["tag", "-pub_date", "-post"], name="post_tag_feed_idx"
+            ),
+        ]
+
+
+class Mention(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="mentions")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="mentions")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "post"], name="unique_mention"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-post"], name="mention_feed_idx"
+            ),
+        ]
@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+COUNT_KEY = "paginator_count:{}"
+# Целые в курсоре должны помещаться в 64-битное целое базы
+MAX_INTEGER = 2**63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def after_key(values, ordering):
+    """
+    Условие "строго после values" для сортировки ordering.
+    """
+    keys = [field.lstrip("-") for field in ordering]
+    condition = Q()
+    for position, field in enumerate(ordering):
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = Q(**{f"{keys[position]}__{lookup}": values[position]})
+        for previous_key, value in zip(keys[:position], values):
+            step &= Q(**{previous_key: value})
+        condition |= step
+    return condition
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return "<KeysetPage of %s objects>" % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Постраничный вывод по ключу сортировки вместо OFFSET и COUNT(*).
+    """
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-id")):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.keys = tuple(field.lstrip("-") for field in self.ordering)
+
+    def encode_cursor(self, obj, direction):
+        values = [self._value_to_json(getattr(obj, key)) for key in self.keys]
+        raw = json.dumps({"d": direction, "k": values}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            direction, values = data["d"], data["k"]
+            if direction not in ("next", "prev") or not isinstance(values, list):
+                raise InvalidCursor(cursor)
+            if len(values) != len(self.keys):
+                raise InvalidCursor(cursor)
+            values = [
+                self._value_from_json(key, value)
+                for key, value in zip(self.keys, values)
+            ]
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise InvalidCursor(cursor)
+        if not all(map(self._valid_key_value, values)):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    def get_page(self, cursor=None):
+        """
+        Возвращает страницу для курсора, при битом курсоре - первую.
+        """
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                direction, values = "next", None
+        else:
+            direction, values = "next", None
+
+        if direction == "next":
+            rows = self._fetch(values, self.ordering)
+            has_more = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+            has_previous = values is not None
+            has_next = has_more
+        else:
+            rows = self._fetch(values, self._reversed_ordering())
+            has_more = len(rows) > self.per_page
+            rows = rows[: self.per_page][::-1]
+            has_previous = has_more
+            has_next = True
+
+        return self._make_page(rows, has_next, has_previous)
+
+    def _make_page(self, rows, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1], "next")
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], "prev")
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    def _fetch(self, values, ordering):
+        queryset = self.object_list.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(values, ordering))
+        return list(queryset[: self.per_page + 1])
+
+    def _after(self, values, ordering):
+        return after_key(values, ordering)
+
+    def _reversed_ordering(self):
+        return tuple(
+            field[1:] if field.startswith("-") else f"-{field}"
+            for field in self.ordering
+        )
+
+    def _sort_key(self, obj):
+        return tuple(getattr(obj, key) for key in self.keys)
+
+    def _value_to_json(self, value):
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return value
+
+    def _valid_key_value(self, value):
+        # Ключ сортировки не бывает NULL, а списки и словари в запрос не попадут
+        if value is None or isinstance(value, (list, dict)):
+            return False
+        return not isinstance(value, int) or -MAX_INTEGER <= value <= MAX_INTEGER
+
+    def _value_from_json(self, key, value):
+        try:
+            field = self.object_list.model._meta.get_field(key)
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
+
+
+def estimate_rows(model, using="default"):
+    """
+    Число строк таблицы по статистике планировщика, None если ее нет.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == "sqlite":
+        # Первое число в stat - количество строк, заполняется командой ANALYZE
+        sql = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator без точного COUNT(*) по большой таблице.
+
+    Для всей таблицы берет оценку из статистики СУБД, для отфильтрованной
+    выборки считает COUNT(*) и запоминает его в кеше ненадолго.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = COUNT_KEY.format(
+            hashlib.md5(f"{queryset.db}:{sql}:{params}".encode()).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.ESTIMATED_COUNT_TIMEOUT)
+        return count
@@ -0,0 +1,61 @@
+"""
+Реакции на записи со счетчиком, разложенным по шардам.
+"""
+
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from posts.cache import LIKES_KEY, refresh_post_pages
+from posts.models import Post, Reaction, ReactionCounter
+
+
+def toggle(user, post):
+    """
+    Ставит или снимает реакцию, возвращает, стоит ли она теперь.
+    """
+    deleted, _ = Reaction.objects.filter(user=user, post=post).delete()
+    if deleted:
+        return False
+    Reaction.objects.get_or_create(user=user, post=post)
+    return True
+
+
+def add_to_counter(post_id, delta):
+    shard = random.randrange(settings.REACTION_COUNTER_SHARDS)
+    shards = ReactionCounter.objects.filter(post=post_id)
+    if shards.filter(shard=shard).update(count=F("count") + delta):
+        return
+    if delta < 0:
+        # Отнять можно из любого шарда, важна только сумма. Шардов может
+        # уже не быть, если реакции удаляются вместе с записью
+        any_shard = shards.values_list("pk", flat=True).first()
+        if any_shard is not None:
+            ReactionCounter.objects.filter(pk=any_shard).update(
+                count=F("count") + delta
+            )
+        return
+    try:
+        with transaction.atomic():
+            ReactionCounter.objects.create(post_id=post_id, shard=shard, count=delta)
+    except IntegrityError:
+        shards.filter(shard=shard).update(count=F("count") + delta)
+
+
+def refresh_total(post_id, delta):
+    try:
+        cache.incr(LIKES_KEY.format(post_id), delta)
+    except ValueError:
+        # Итога в кеше нет, его посчитают по шардам при чтении
+        pass
+    # Страницы целиком лежат в кеше, и пересобирать их на каждый лайк
+    # популярной записи нельзя
+    refresh_post_pages(Post.objects.filter(pk=post_id).only("author", "group"))
+
+
+def record(post_id, delta):
+    add_to_counter(post_id, delta)
+    transaction.on_commit(lambda: refresh_total(post_id, delta))
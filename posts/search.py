@@ -0,0 +1,204 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from posts.models import Post
+from posts.paginators import KeysetPaginator
+
+POSTS_TABLE = "posts_post_fts"
+COMMENTS_TABLE = "posts_comment_fts"
+# Совпадение в комментарии весит меньше, чем в самой записи (bm25 отрицателен)
+COMMENT_RANK_FACTOR = 0.5
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+SNIPPET_TOKENS = 16
+
+SNIPPET_SQL = "snippet({table}, 0, %s, %s, '…', %s)"
+SEARCH_SQL = f"""
+    SELECT matches.post_id, MIN(matches.rank) AS rank, matches.snippet
+    FROM (
+        SELECT rowid AS post_id, bm25({POSTS_TABLE}) AS rank,
+            {SNIPPET_SQL.format(table=POSTS_TABLE)} AS snippet
+        FROM {POSTS_TABLE} WHERE {POSTS_TABLE} MATCH %s
+        UNION ALL
+        SELECT post_id, bm25({COMMENTS_TABLE}) * {COMMENT_RANK_FACTOR},
+            {SNIPPET_SQL.format(table=COMMENTS_TABLE)}
+        FROM {COMMENTS_TABLE} WHERE {COMMENTS_TABLE} MATCH %s
+    ) AS matches
+    JOIN posts_post ON posts_post.id = matches.post_id
+    WHERE {{filters}}
+    GROUP BY matches.post_id
+    HAVING {{keyset}}
+    ORDER BY rank {{direction}}, matches.post_id {{direction}}
+    LIMIT %s
+"""
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def split_words(text):
+    return re.findall(r"\w+", text)
+
+
+def to_match_query(words):
+    """
+    Собирает из слов безопасный запрос FTS5: каждое слово - префикс.
+    """
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def filter_matching(queryset, text, table):
+    """
+    Оставляет в queryset строки, чей текст находит индекс table.
+    """
+    words = split_words(text)
+    if not words:
+        return queryset
+    if not is_available():
+        for word in words:
+            queryset = queryset.filter(text__icontains=word)
+        return queryset
+    return queryset.filter(
+        pk__in=RawSQL(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH %s",
+            [to_match_query(words)],
+        )
+    )
+
+
+def index_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POSTS_TABLE} WHERE rowid = %s", [post_id])
+        cursor.execute(
+            f"INSERT INTO {POSTS_TABLE} (rowid, text) "
+            "SELECT id, text FROM posts_post WHERE id = %s",
+            [post_id],
+        )
+
+
+def unindex_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POSTS_TABLE} WHERE rowid = %s", [post_id])
+
+
+def index_comment(comment):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {COMMENTS_TABLE} WHERE rowid = %s", [comment.pk])
+        cursor.execute(
+            f"INSERT INTO {COMMENTS_TABLE} (rowid, text, post_id) VALUES (%s, %s, %s)",
+            [comment.pk, comment.text, comment.post_id],
+        )
+
+
+def unindex_comment(comment_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {COMMENTS_TABLE} WHERE rowid = %s", [comment_id])
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POSTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {POSTS_TABLE} (rowid, text) SELECT id, text FROM posts_post"
+        )
+        cursor.execute(f"DELETE FROM {COMMENTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {COMMENTS_TABLE} (rowid, text, post_id) "
+            "SELECT id, text, post_id FROM posts_comment"
+        )
+        cursor.execute(f"INSERT INTO {POSTS_TABLE}({POSTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(
+            f"INSERT INTO {COMMENTS_TABLE}({COMMENTS_TABLE}) VALUES ('optimize')"
+        )
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+    )
+
+
+class SearchPaginator(KeysetPaginator):
+    """
+    Постраничная выдача поиска по релевантности, ключ (rank, id).
+    """
+
+    def __init__(self, text, per_page, group=None, author=None):
+        super().__init__(Post.objects.feed(), per_page, ordering=("rank", "id"))
+        self.words = split_words(text)
+        self.query = to_match_query(self.words)
+        self.group = group
+        self.author = author
+
+    def _fetch(self, values, ordering):
+        if not self.query:
+            return []
+        if not is_available():
+            return self._fetch_fallback(values, ordering)
+
+        direction = "DESC" if ordering[0].startswith("-") else "ASC"
+        compare = "<" if direction == "DESC" else ">"
+        snippet = [SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS]
+        params = [*snippet, self.query, *snippet, self.query]
+        filters = ["1 = 1"]
+        if self.group is not None:
+            filters.append("posts_post.group_id = %s")
+            params.append(self.group.pk)
+        if self.author is not None:
+            filters.append("posts_post.author_id = %s")
+            params.append(self.author.pk)
+        keyset = "1 = 1"
+        if values is not None:
+            rank, post_id = values
+            keyset = (
+                f"(MIN(matches.rank) {compare} %s OR "
+                f"(MIN(matches.rank) = %s AND matches.post_id {compare} %s))"
+            )
+            params.extend([rank, rank, post_id])
+        params.append(self.per_page + 1)
+
+        sql = SEARCH_SQL.format(
+            filters=" AND ".join(filters), keyset=keyset, direction=direction
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            matches = cursor.fetchall()
+
+        posts = self.object_list.in_bulk([post_id for post_id, _, _ in matches])
+        rows = []
+        for post_id, rank, snippet in matches:
+            post = posts.get(post_id)
+            if post is not None:
+                post.rank = rank
+                post.search_snippet = highlight(snippet)
+                rows.append(post)
+        return rows
+
+    def _fetch_fallback(self, values, ordering):
+        # Без FTS5 ищем в тексте каждое слово; ранг у всех записей одинаковый
+        posts = filter_matching(self.object_list, " ".join(self.words), POSTS_TABLE)
+        if self.group is not None:
+            posts = posts.filter(group=self.group)
+        if self.author is not None:
+            posts = posts.filter(author=self.author)
+        id_ordering = ordering[1]
+        if values is not None:
+            lookup = "lt" if id_ordering.startswith("-") else "gt"
+            posts = posts.filter(**{f"id__{lookup}": values[1]})
+        rows = list(posts.order_by(id_ordering)[: self.per_page + 1])
+        for post in rows:
+            post.rank = 0
+            post.search_snippet = ""
+        return rows
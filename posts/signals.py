@@ -0,0 +1,126 @@
+from django.core.signals import request_finished
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from posts import (
+    reactions,
+    search,
+    suggestions,
+    tags,
+    timelines,
+    trending,
+    view_counts,
+)
+from posts.cache import (
+    GLOBAL_SCOPE,
+    bump_generations,
+    invalidate_post_pages,
+    invalidate_profiles,
+)
+from posts.models import Comment, Follow, Group, Post, Reaction, UserStats
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        UserStats.bump(instance.author_id, posts_count=1)
+        Group.bump(instance.group_id, 1)
+        timelines.fan_out_post(instance)
+        trending.record_post(instance)
+    elif hasattr(instance, "loaded_group_id"):
+        if instance.loaded_group_id != instance.group_id:
+            Group.bump(instance.loaded_group_id, -1)
+            Group.bump(instance.group_id, 1)
+            trending.move_post(instance)
+    invalidate_post_pages(instance, getattr(instance, "loaded_group_id", None))
+    instance.loaded_group_id = instance.group_id
+    search.index_post(instance.pk)
+    tags.reindex_posts([instance], fresh=created)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    UserStats.bump(instance.author_id, posts_count=-1)
+    Group.bump(instance.group_id, -1)
+    invalidate_post_pages(instance)
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_comment(instance)
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F("comments_count") + 1
+        )
+        if instance.parent_id is not None:
+            Comment.objects.filter(pk__in=instance.parent.path_ids()).update(
+                replies_count=F("replies_count") + 1
+            )
+        invalidate_post_pages(instance.post)
+        trending.record_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    search.unindex_comment(instance.pk)
+    Post.objects.filter(pk=instance.post_id).update(
+        comments_count=Greatest(F("comments_count") - 1, 0)
+    )
+    if instance.parent_id is not None:
+        # Предков берем из своего пути: при каскадном удалении ветки
+        # родителя в базе уже может не быть
+        Comment.objects.filter(pk__in=instance.path_ids()[:-1]).update(
+            replies_count=Greatest(F("replies_count") - 1, 0)
+        )
+    post = Post.objects.filter(pk=instance.post_id).first()
+    if post is not None:
+        invalidate_post_pages(post)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.bump(instance.author_id, followers_count=1)
+        UserStats.bump(instance.user_id, following_count=1)
+        timelines.backfill(instance.user_id, instance.author_id)
+        suggestions.add_follow(instance.user_id, instance.author_id)
+        invalidate_profiles(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    UserStats.bump(instance.author_id, followers_count=-1)
+    UserStats.bump(instance.user_id, following_count=-1)
+    timelines.remove_author(instance.user_id, instance.author_id)
+    suggestions.remove_follow(instance.user_id, instance.author_id)
+    invalidate_profiles(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Reaction)
+def reaction_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        reactions.record(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Reaction)
+def reaction_deleted(sender, instance, **kwargs):
+    reactions.record(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_generations(GLOBAL_SCOPE)
+
+
+@receiver(request_finished)
+def flush_view_counts(sender, **kwargs):
+    view_counts.flush_if_due()
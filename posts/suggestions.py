@@ -0,0 +1,228 @@
+"""
+Рекомендации "кого почитать" по графу подписок.
+
+Полный пересчет - команда compute_follow_suggestions. Пересчитывать граф
+на каждый запрос слишком дорого, поэтому для каждого пользователя
+хранится готовый топ FollowSuggestion, а новые подписки между пересчетами
+правят его на лету.
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from posts.cache import invalidate_profiles
+from posts.models import Follow, FollowSuggestion
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+REBUILD_CHUNK_SIZE = 500
+EDGES_CHUNK_SIZE = 10000
+
+
+class SparseFollowGraph:
+    """
+    Граф как разреженная матрица смежности A: A[u, a] = 1, если u подписан
+    на a. Друзья друзей - A·A, подписки похожих пользователей - O·A, где
+    O = A·Aᵀ без диагонали - число общих подписок у пары пользователей.
+    """
+
+    def __init__(self, edges):
+        edges = np.fromiter(
+            (value for edge in edges for value in edge), dtype=np.int64
+        ).reshape(-1, 2)
+        self.ids = np.unique(edges)
+        rows = np.searchsorted(self.ids, edges[:, 0])
+        cols = np.searchsorted(self.ids, edges[:, 1])
+        size = len(self.ids)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(edges)), (rows, cols)), shape=(size, size)
+        )
+        self.transposed = self.matrix.T.tocsr()
+
+    def users(self):
+        return self.ids[np.diff(self.matrix.indptr) > 0].tolist()
+
+    def top(self, user_ids, weight, limit):
+        positions = np.searchsorted(self.ids, user_ids)
+        block = self.matrix[positions]
+
+        overlap = (block @ self.transposed).tocoo()
+        others = overlap.col != positions[overlap.row]
+        overlap = sparse.csr_matrix(
+            (overlap.data[others], (overlap.row[others], overlap.col[others])),
+            shape=overlap.shape,
+        )
+        scores = block @ self.matrix + weight * (overlap @ self.matrix)
+        scores = (scores - scores.multiply(block)).tocoo()
+
+        keep = (scores.data > 0) & (scores.col != positions[scores.row])
+        rows, cols, data = scores.row[keep], scores.col[keep], scores.data[keep]
+        authors = self.ids[cols]
+        order = np.lexsort((authors, -data, rows))
+        rows, authors, data = rows[order], authors[order], data[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        best = rank < limit
+        rows, authors, data = rows[best], authors[best], data[best]
+
+        bounds = np.searchsorted(rows, np.arange(len(user_ids) + 1))
+        for number, user_id in enumerate(user_ids):
+            start, end = bounds[number], bounds[number + 1]
+            yield user_id, list(
+                zip(authors[start:end].tolist(), data[start:end].tolist())
+            )
+
+
+class SetFollowGraph:
+    """
+    Тот же расчет на словарях множеств, если numpy/scipy не установлены.
+    """
+
+    def __init__(self, edges):
+        self.follows = defaultdict(set)
+        self.followers = defaultdict(set)
+        for user_id, author_id in edges:
+            self.follows[user_id].add(author_id)
+            self.followers[author_id].add(user_id)
+
+    def users(self):
+        return sorted(self.follows)
+
+    def top(self, user_ids, weight, limit):
+        for user_id in user_ids:
+            followed = self.follows.get(user_id, set())
+            scores = defaultdict(float)
+            overlap = Counter()
+            for author_id in followed:
+                for candidate in self.follows.get(author_id, ()):
+                    scores[candidate] += 1
+                for other in self.followers[author_id]:
+                    if other != user_id:
+                        overlap[other] += 1
+            for other, common in overlap.items():
+                for candidate in self.follows[other]:
+                    scores[candidate] += weight * common
+            best = sorted(
+                (
+                    (-score, candidate)
+                    for candidate, score in scores.items()
+                    if candidate != user_id and candidate not in followed
+                ),
+            )[:limit]
+            yield user_id, [(candidate, -score) for score, candidate in best]
+
+
+ENGINES = {"scipy": SparseFollowGraph, "python": SetFollowGraph}
+
+
+def default_engine():
+    return "scipy" if sparse is not None else "python"
+
+
+def load_graph(engine=None):
+    engine = engine or default_engine()
+    if engine == "scipy" and sparse is None:
+        raise ImportError("Для движка scipy нужны numpy и scipy")
+    edges = Follow.objects.values_list("user_id", "author_id")
+    return ENGINES[engine](edges.iterator(EDGES_CHUNK_SIZE))
+
+
+def store(chunk, rows):
+    suggestions = [
+        FollowSuggestion(user_id=user_id, author_id=author_id, score=score)
+        for user_id, top in rows
+        for author_id, score in top
+    ]
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user__in=chunk).delete()
+        FollowSuggestion.objects.bulk_create(suggestions, REBUILD_CHUNK_SIZE)
+    # Свои рекомендации пользователь видит на странице своего профиля
+    invalidate_profiles(*chunk)
+
+
+def rebuild(engine=None, chunk_size=REBUILD_CHUNK_SIZE):
+    """
+    Пересчитывает рекомендации всех, у кого есть подписки, пачками.
+    """
+    graph = load_graph(engine)
+    users = graph.users()
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start : start + chunk_size]
+        store(
+            chunk,
+            graph.top(
+                chunk,
+                settings.FOLLOW_SUGGESTIONS_COFOLLOW_WEIGHT,
+                settings.FOLLOW_SUGGESTIONS_STORED,
+            ),
+        )
+    FollowSuggestion.objects.exclude(user__in=Follow.objects.values("user")).delete()
+    return len(users)
+
+
+def for_user(user, limit=None):
+    if not user.is_authenticated:
+        return []
+    suggestions = (
+        FollowSuggestion.objects.filter(user=user)
+        .select_related("author")
+        .order_by("-score", "author_id")
+    )
+    return [
+        suggestion.author
+        for suggestion in suggestions[: limit or settings.FOLLOW_SUGGESTIONS_SHOWN]
+    ]
+
+
+def friends_of_friend(user_id, author_id):
+    followed = Follow.objects.filter(user=user_id).values("author")
+    return list(
+        Follow.objects.filter(user=author_id)
+        .exclude(author=user_id)
+        .exclude(author__in=followed)
+        .values_list("author_id", flat=True)[: settings.FOLLOW_SUGGESTIONS_FANOUT]
+    )
+
+
+def add_follow(user_id, author_id):
+    """
+    Между полными пересчетами учитывает только друзей друзей: подписки
+    похожих пользователей меняются от любой чужой подписки, их пересчет
+    остается полному проходу.
+    """
+    FollowSuggestion.objects.filter(user=user_id, author=author_id).delete()
+    candidates = friends_of_friend(user_id, author_id)
+    FollowSuggestion.objects.filter(user=user_id, author__in=candidates).update(
+        score=F("score") + 1
+    )
+    FollowSuggestion.objects.bulk_create(
+        [
+            FollowSuggestion(user_id=user_id, author_id=candidate, score=1)
+            for candidate in candidates
+        ],
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def remove_follow(user_id, author_id):
+    candidates = friends_of_friend(user_id, author_id)
+    FollowSuggestion.objects.filter(user=user_id, author__in=candidates).update(
+        score=F("score") - 1
+    )
+    FollowSuggestion.objects.filter(user=user_id, score__lte=0).delete()
+
+
+def trim(user_id):
+    stale = (
+        FollowSuggestion.objects.filter(user=user_id)
+        .order_by("-score", "author_id")
+        .values_list("pk", flat=True)[settings.FOLLOW_SUGGESTIONS_STORED :]
+    )
+    FollowSuggestion.objects.filter(pk__in=list(stale)).delete()
@@ -0,0 +1,122 @@
+"""
+Хештеги и упоминания в тексте записей.
+
+Теги и упомянутые пользователи хранятся в таблицах PostTag и Mention с
+копией даты публикации, поэтому ленты тега и упоминаний листаются по
+индексу (ключ, -pub_date, -post) так же, как ленты подписок.
+"""
+
+import re
+from collections import defaultdict
+
+from django.db.models import Q
+
+from posts.models import Mention, Post, PostTag, Tag, User
+from posts.paginators import KeysetPaginator
+
+TAG_RE = re.compile(r"(?<![\w#&])#(\w{1,50})")
+MENTION_RE = re.compile(r"(?<![\w@])@([\w.@+-]{1,150})")
+ENTRY_ORDERING = ("-pub_date", "-post_id")
+ENTRY_REVERSED = ("pub_date", "post_id")
+
+
+def parse_tags(text):
+    return {name.lower() for name in TAG_RE.findall(text)}
+
+
+def parse_mentions(text):
+    # Точка в конце - скорее конец предложения, чем часть имени
+    return {name.rstrip(".") for name in MENTION_RE.findall(text)} - {""}
+
+
+def tag_ids(names):
+    if not names:
+        return {}
+    ids = dict(Tag.objects.filter(name__in=names).values_list("name", "pk"))
+    missing = names - ids.keys()
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in missing], ignore_conflicts=True
+        )
+        ids.update(Tag.objects.filter(name__in=missing).values_list("name", "pk"))
+    return ids
+
+
+def user_ids(usernames):
+    if not usernames:
+        return {}
+    return dict(
+        User.objects.filter(username__in=usernames).values_list("username", "pk")
+    )
+
+
+def sync(model, field, posts, wanted, fresh):
+    """
+    Приводит строки индекса к wanted, трогая только изменившиеся.
+    """
+    current = defaultdict(set)
+    if not fresh:
+        rows = model.objects.filter(post__in=wanted).values_list("post_id", field)
+        for post_id, value in rows:
+            current[post_id].add(value)
+    stale, new = Q(), []
+    for post in posts:
+        for value in current[post.pk] - wanted[post.pk]:
+            stale |= Q(post=post.pk, **{field: value})
+        new.extend(
+            model(post_id=post.pk, pub_date=post.pub_date, **{field: value})
+            for value in wanted[post.pk] - current[post.pk]
+        )
+    if stale:
+        model.objects.filter(stale).delete()
+    if new:
+        model.objects.bulk_create(new, ignore_conflicts=True)
+
+
+def reindex_posts(posts, fresh=False):
+    """
+    Переиндексирует теги и упоминания записей. fresh - записи только что
+    созданы и старых строк индекса у них нет.
+    """
+    parsed = {
+        post.pk: (parse_tags(post.text), parse_mentions(post.text)) for post in posts
+    }
+    tags = tag_ids({name for names, _ in parsed.values() for name in names})
+    users = user_ids({name for _, names in parsed.values() for name in names})
+    sync(
+        PostTag,
+        "tag_id",
+        posts,
+        {pk: {tags[name] for name in names} for pk, (names, _) in parsed.items()},
+        fresh,
+    )
+    sync(
+        Mention,
+        "user_id",
+        posts,
+        {
+            pk: {users[name] for name in names if name in users}
+            for pk, (_, names) in parsed.items()
+        },
+        fresh,
+    )
+
+
+class IndexedFeedPaginator(KeysetPaginator):
+    """
+    Лента по строкам индекса тегов или упоминаний: страница выбирается по
+    индексу, а записи подгружаются одним запросом по id.
+    """
+
+    def __init__(self, entries, per_page):
+        super().__init__(Post.objects.feed(), per_page)
+        self.entries = entries
+
+    def _fetch(self, values, ordering):
+        entry_ordering = ENTRY_ORDERING if ordering == self.ordering else ENTRY_REVERSED
+        entries = self.entries.order_by(*entry_ordering)
+        if values is not None:
+            entries = entries.filter(self._after(values, entry_ordering))
+        post_ids = list(entries.values_list("post_id", flat=True)[: self.per_page + 1])
+        posts = self.object_list.in_bulk(post_ids)
+        return [posts[pk] for pk in post_ids if pk in posts]
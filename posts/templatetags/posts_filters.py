@@ -1,5 +1,10 @@
 from django import template
+from django.urls import reverse
+from django.utils.html import conditional_escape, format_html
+from django.utils.safestring import mark_safe
 
+from posts.cache import attach_post_cards
+from posts.tags import MENTION_RE, TAG_RE
 
 register = template.Library()
 
@@ -18,3 +23,43 @@ def get_value_from_dict(dictionary, key):
 @register.filter
 def get_value_from_list(list, position):
     return list[position]
+
+
+@register.simple_tag
+def post_card_parts(post):
+    if not hasattr(post, "card"):
+        attach_post_cards([post])
+    return post.card
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    query = context["request"].GET.copy()
+    query["cursor"] = cursor
+    return f"?{query.urlencode()}"
+
+
+def _tag_link(match):
+    name = match.group(1)
+    return format_html(
+        '<a href="{}">#{}</a>', reverse("tag", args=[name.lower()]), name
+    )
+
+
+def _mention_link(match):
+    name = match.group(1).rstrip(".")
+    if not name:
+        return match.group(0)
+    link = format_html('<a href="{}">@{}</a>', reverse("profile", args=[name]), name)
+    return link + match.group(1)[len(name) :]
+
+
+@register.filter(needs_autoescape=True)
+def link_tags(text, autoescape=True):
+    """
+    Превращает #теги и @упоминания в ссылки.
+    """
+    if autoescape:
+        text = conditional_escape(text)
+    text = TAG_RE.sub(_tag_link, text)
+    return mark_safe(MENTION_RE.sub(_mention_link, text))
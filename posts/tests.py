@@ -1,12 +1,69 @@
-from io import BytesIO
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-from django.core.cache import cache
+from django.apps import apps
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import CommandError, call_command
+from django.db import (
+    IntegrityError,
+    OperationalError,
+    connection,
+    connections,
+    transaction,
+)
+from django.db.utils import ConnectionHandler
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from PIL import Image
 
-from posts.models import Follow, Group, Post, User
+from posts.cache import (
+    GENERATION_KEY,
+    LOCK_KEY,
+    REFRESH_KEY,
+    STALE_PAGE_KEY,
+    get_generations,
+    get_or_rebuild,
+    index_scope,
+    like_totals,
+    post_card_key,
+    profile_scope,
+    should_refresh,
+)
+from posts.models import (
+    Comment,
+    Follow,
+    FollowSuggestion,
+    Group,
+    GroupTrend,
+    Mention,
+    OnReadAuthor,
+    Post,
+    PostTag,
+    PostTrend,
+    Reaction,
+    ReactionCounter,
+    Tag,
+    TimelineEntry,
+    User,
+    UserStats,
+)
+from posts import reactions, suggestions, tags, timelines, trending, view_counts
+from posts.paginators import EstimatedCountPaginator, KeysetPaginator, after_key
+from posts.thumbnails import generate_thumbnails, schedule_thumbnails
+from yatube.routers import STICKY_COOKIE
+from yatube.cache import shared_cache_from_env
+from yatube.db import DatabaseHealthCheckMiddleware, database_from_env
+from yatube.sqlite import lock_metrics, reset_lock_metrics, write_transaction
 
 
 def make_post_with_image(self, just_image=False):
@@ -221,14 +278,1377 @@ class TestPostsApp(TestCase):
 class TestCache(TestCase):
     def setUp(self):
         self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.group = Group.objects.create(
+            slug="testslug", title="mytestgroup", description="testdescr"
+        )
         self.cl = Client()
+        cache.clear()
+
+    def test_index_served_from_cache(self):
+        self.cl.get(reverse("index"))
+        with self.assertNumQueries(0):
+            self.cl.get(reverse("index"))
 
     def test_post_in_index(self):
         resp = self.cl.get(reverse("index"))
         self.post = Post.objects.create(text="MyTestText111", author=self.user)
         resp = self.cl.get(reverse("index"))
-        self.assertNotContains(
+        self.assertContains(
             resp,
             "MyTestText111",
-            msg_prefix="Cache is not working, created post on index page",
+            msg_prefix="Cache is stale, created post is missing on index page",
+        )
+
+    def test_comment_invalidates_group_and_profile(self):
+        post = Post.objects.create(text="text", author=self.user, group=self.group)
+        urls = [
+            reverse("group", kwargs={"slug": "testslug"}),
+            reverse("profile", kwargs={"username": "mytestuser"}),
+        ]
+        for url in urls:
+            self.assertContains(self.cl.get(url), "Добавить комментарий")
+        Comment.objects.create(post=post, author=self.user, text="comment")
+        for url in urls:
+            self.assertContains(self.cl.get(url), "1 комментариев")
+
+    def test_group_rename_invalidates_index(self):
+        Post.objects.create(text="text", author=self.user, group=self.group)
+        self.cl.get(reverse("index"))
+        self.group.title = "renamedgroup"
+        self.group.save()
+        self.assertContains(self.cl.get(reverse("index")), "renamedgroup")
+
+    def test_stale_page_served_while_another_request_rebuilds(self):
+        Post.objects.create(text="oldtext", author=self.user)
+        self.cl.get(reverse("index"))
+        Post.objects.create(text="newtext", author=self.user)
+        stale_key = STALE_PAGE_KEY.format(
+            view="index", viewer=0, path=hashlib.md5(b"/").hexdigest()
+        )
+        cache.add(LOCK_KEY.format(stale_key), 1)
+        with self.assertNumQueries(0):
+            response = self.cl.get(reverse("index"))
+        self.assertContains(response, "oldtext")
+        self.assertNotContains(response, "newtext")
+
+        cache.delete(LOCK_KEY.format(stale_key))
+        self.assertContains(self.cl.get(reverse("index")), "newtext")
+
+    @override_settings(PAGE_CACHE_GRACE=0, PAGE_CACHE_LOCK_WAIT=0)
+    def test_stale_page_not_served_past_grace(self):
+        Post.objects.create(text="oldtext", author=self.user)
+        self.cl.get(reverse("index"))
+        Post.objects.create(text="newtext", author=self.user)
+        stale_key = STALE_PAGE_KEY.format(
+            view="index", viewer=0, path=hashlib.md5(b"/").hexdigest()
+        )
+        cache.add(LOCK_KEY.format(stale_key), 1)
+        # Прошлая версия устарела с новой записью, а запас по времени нулевой
+        self.assertContains(self.cl.get(reverse("index")), "newtext")
+
+    def test_single_flight_rebuild(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            # Пока строится значение, приходит второй запрос за тем же ключом
+            if len(calls) == 1:
+                self.assertEqual(get_or_rebuild("key", "stale", build, 60), "stale")
+            return "fresh"
+
+        cache.set(
+            "stale",
+            {
+                "value": "stale",
+                "delta": 0,
+                "expires": 0,
+                "stale_until": time.time() + 60,
+            },
+        )
+        self.assertEqual(get_or_rebuild("key", "stale", build, 60), "fresh")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(get_or_rebuild("key", "stale", build, 60), "fresh")
+
+    def test_early_expiry_is_probabilistic(self):
+        now = time.time()
+        entry = {"value": "page", "delta": 1.0, "expires": now + 2}
+        with mock.patch("posts.cache.random.random", return_value=0.0):
+            self.assertFalse(should_refresh(entry))
+        with mock.patch("posts.cache.random.random", return_value=0.99):
+            self.assertTrue(should_refresh(entry))
+        self.assertFalse(should_refresh({**entry, "expires": now + 3600}))
+
+
+class TestKeysetPagination(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.posts = [
+            Post.objects.create(text=f"Post {number}", author=self.user)
+            for number in range(25)
+        ]
+        Post.objects.update(pub_date=self.posts[0].pub_date)
+        self.cl = Client()
+        cache.clear()
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        expected = sorted(self.posts, key=lambda post: post.id, reverse=True)
+
+        first = paginator.get_page(None)
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertEqual(list(first), expected[:10])
+        self.assertEqual(list(second), expected[10:20])
+        self.assertEqual(list(third), expected[20:])
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+
+        back = paginator.get_page(third.previous_cursor)
+        self.assertEqual(list(back), expected[10:20])
+        self.assertEqual(list(paginator.get_page(back.previous_cursor)), expected[:10])
+
+    def test_broken_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        page = paginator.get_page("not-a-cursor")
+        self.assertEqual(list(page), list(paginator.get_page(None)))
+
+    def test_tampered_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        first = [post.pk for post in paginator.get_page(None)]
+        tampered = [
+            {"d": "next", "k": ["bad", "y"]},
+            {"d": "next", "k": 5},
+            {"d": "prev", "k": [None, None]},
+            {"d": "next", "k": [[1], {"a": 1}]},
+            {"d": "next", "k": [self.posts[0].pub_date.isoformat(), 10**30]},
+        ]
+        for data in tampered:
+            cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+            with self.subTest(data=data):
+                self.assertEqual(
+                    [post.pk for post in paginator.get_page(cursor)], first
+                )
+                for url in ("/", "/mytestuser/", "/search/?q=post"):
+                    response = self.cl.get(url, {"cursor": cursor})
+                    self.assertEqual(response.status_code, 200)
+
+    def test_index_links_next_page(self):
+        response = self.cl.get(reverse("index"))
+        page = response.context["page"]
+        self.assertContains(response, f"?cursor={page.next_cursor}")
+        response = self.cl.get(reverse("index"), {"cursor": page.next_cursor})
+        self.assertEqual(len(response.context["page"]), 10)
+
+
+class TestTimelines(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.author = User.objects.create_user("author", "au@test.ru", "authorpass")
+        self.cl_auth = Client()
+        self.cl_auth.force_login(self.user)
+        cache.clear()
+
+    def test_new_post_fanned_out_to_followers(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text="FanOut", author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+        response = self.cl_auth.get(reverse("follow_index"))
+        self.assertContains(response, "FanOut")
+
+    def test_unfollow_clears_timeline(self):
+        Post.objects.create(text="Backfilled", author=self.author)
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+        follow.delete()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    @override_settings(TIMELINE_MAX_LENGTH=3)
+    def test_timeline_trimmed(self):
+        for number in range(5):
+            Post.objects.create(text=f"Post {number}", author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 3)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_read_on_demand(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text="Celebrity", author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.cl_auth.get(reverse("follow_index"))
+        self.assertContains(response, "Celebrity")
+
+    def test_author_leaving_on_read_set_backfilled_by_command(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0):
+            cache.delete(timelines.AUTHOR_SETS_KEY)
+            Post.objects.create(text="Celebrity", author=self.author)
+        # Кеш множеств истек, автор больше не популярен
+        cache.delete(timelines.AUTHOR_SETS_KEY)
+        response = self.cl_auth.get(reverse("follow_index"))
+        self.assertContains(response, "Celebrity")
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        Post.objects.create(text="Ordinary", author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(timelines.on_read_authors(), {self.author.pk})
+        self.assertTrue(OnReadAuthor.objects.get(author=self.author).backfill_pending)
+
+        # Команда идет в другом процессе и кеша воркеров не видит
+        cache.clear()
+        out = StringIO()
+        call_command("rebuild_timelines", pending_authors=True, stdout=out)
+        self.assertIn("Дозаполнено авторов: 1", out.getvalue())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(timelines.on_read_authors(), frozenset())
+        self.assertFalse(OnReadAuthor.objects.exists())
+
+
+class TestCounters(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.author = User.objects.create_user("author", "au@test.ru", "authorpass")
+        self.post = Post.objects.create(text="MyTestText", author=self.author)
+        cache.clear()
+
+    def test_comment_counter(self):
+        comment = Comment.objects.create(post=self.post, author=self.user, text="c")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_edit_keeps_comment_counter(self):
+        stale_post = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author=self.user, text="c")
+        stale_post.text = "Edited"
+        stale_post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_user_stats(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            UserStats.objects.filter(user=self.author).values_list(
+                "posts_count", "followers_count", "following_count"
+            )[0],
+            (1, 1, 0),
+        )
+        self.assertEqual(UserStats.objects.get(user=self.user).following_count, 1)
+
+    def test_group_counter_follows_post_group(self):
+        first = Group.objects.create(slug="first", title="first", description="d")
+        second = Group.objects.create(slug="second", title="second", description="d")
+        post = Post.objects.create(text="grouped", author=self.author, group=first)
+        post = Post.objects.get(pk=post.pk)
+        post.group = second
+        post.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.posts_count, second.posts_count), (0, 1))
+
+    def test_reconcile_counters(self):
+        Comment.objects.create(post=self.post, author=self.user, text="c")
+        Post.objects.update(comments_count=5)
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        scopes = [index_scope(), profile_scope("author")]
+        before = get_generations(scopes)
+        call_command("reconcile_counters", "--dry-run", stdout=StringIO())
+        self.assertEqual(get_generations(scopes), before)
+        call_command("reconcile_counters", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).posts_count, 1)
+        after = get_generations(scopes)
+        self.assertTrue(all(new != old for new, old in zip(after, before)))
+
+
+class TestFeedQueries(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.group = Group.objects.create(
+            slug="testslug", title="mytestgroup", description="testdescr"
+        )
+        self.cl = Client()
+        self.cl_auth = Client()
+        self.cl_auth.force_login(self.user)
+        Follow.objects.create(
+            user=self.user,
+            author=User.objects.create_user("author", "au@test.ru", "authorpass"),
+        )
+
+    def add_posts(self, total):
+        author = User.objects.get(username="author")
+        for number in range(total):
+            post = Post.objects.create(
+                text=f"Post {number}", author=author, group=self.group
+            )
+            Comment.objects.create(post=post, author=self.user, text="c")
+
+    def count_queries(self, client, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_constant_queries_per_page(self):
+        urls = [
+            (self.cl, reverse("index")),
+            (self.cl, reverse("group", kwargs={"slug": "testslug"})),
+            (self.cl, reverse("profile", kwargs={"username": "author"})),
+            (self.cl_auth, reverse("follow_index")),
+        ]
+        self.add_posts(1)
+        few = [self.count_queries(client, url) for client, url in urls]
+        self.add_posts(9)
+        many = [self.count_queries(client, url) for client, url in urls]
+        self.assertEqual(few, many)
+
+
+@skipUnless(connection.vendor == "sqlite", "Планы запросов проверяются на SQLite")
+class TestQueryPlans(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.group = Group.objects.create(
+            slug="testslug", title="mytestgroup", description="testdescr"
+        )
+        self.post = Post.objects.create(text="text", author=self.user, group=self.group)
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {index_name}", plan)
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_feed_queries_use_indexes(self):
+        feed = Post.objects.feed()
+        after = after_key([self.post.pub_date, self.post.id], ("-pub_date", "-id"))
+        self.assertUsesIndex(feed[:11], "post_feed_idx")
+        self.assertUsesIndex(feed.filter(after)[:11], "post_feed_idx")
+        self.assertUsesIndex(feed.filter(group=self.group)[:11], "post_group_feed_idx")
+        self.assertUsesIndex(
+            feed.filter(author=self.user).filter(after)[:11], "post_author_feed_idx"
+        )
+        self.assertUsesIndex(
+            TimelineEntry.objects.filter(user=self.user).order_by(
+                "-pub_date", "-post_id"
+            )[:11],
+            "timeline_user_feed_idx",
+        )
+        self.assertUsesIndex(
+            Comment.objects.filter(post=self.post).order_by("created", "id"),
+            "comment_post_created_idx",
+        )
+        root = Comment.objects.create(post=self.post, author=self.user, text="c")
+        self.assertUsesIndex(
+            Comment.objects.filter(post=self.post).subtrees([root]),
+            "comment_post_path_idx",
+        )
+
+    def test_follow_lookup_uses_unique_index(self):
+        plan = Follow.objects.filter(user=self.user, author=self.user).explain()
+        self.assertRegex(plan, r"SEARCH \w+ USING (COVERING )?INDEX")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.user)
+            Follow.objects.create(user=self.user, author=self.user)
+
+
+class TestPostCardCache(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.post = Post.objects.create(text="First", author=self.user)
+        self.other = Post.objects.create(text="Second", author=self.user)
+        cache.clear()
+
+    def card_keys(self):
+        posts = Post.objects.feed().order_by("id")
+        return [post_card_key(post) for post in posts]
+
+    def test_edit_and_comment_change_only_own_card(self):
+        before = self.card_keys()
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = "Edited"
+        post.save()
+        after_edit = self.card_keys()
+        self.assertNotEqual(before[0], after_edit[0])
+        self.assertEqual(before[1], after_edit[1])
+
+        Comment.objects.create(post=self.other, author=self.user, text="c")
+        after_comment = self.card_keys()
+        self.assertEqual(after_edit[0], after_comment[0])
+        self.assertNotEqual(after_edit[1], after_comment[1])
+
+    def test_cached_card_is_used(self):
+        post = Post.objects.feed().get(pk=self.post.pk)
+        cache.set(post_card_key(post), ("<p>cached head</p>", "<p>cached tail</p>"))
+        response = Client().get(reverse("index"))
+        self.assertContains(response, "<p>cached head</p>", html=True)
+        self.assertContains(response, "Second")
+
+    def test_edit_link_only_for_author(self):
+        url = reverse("profile", kwargs={"username": "mytestuser"})
+        self.assertNotContains(Client().get(url), "Редактировать")
+        author_client = Client()
+        author_client.force_login(self.user)
+        self.assertContains(author_client.get(url), "Редактировать")
+
+
+class TestThumbnails(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("mytestuser", "test@test.ru", "mytestpass")
+        self.group = Group.objects.create(
+            slug="testslug", title="mytestgroup", description="testdescr"
+        )
+        self.cl_auth = Client()
+        self.cl_auth.force_login(self.user)
+        cache.clear()
+
+    def test_render_uses_pregenerated_thumbnail(self):
+        post = make_post_with_image(self)
+        generate_thumbnails(post.image)
+        with mock.patch(
+            "sorl.thumbnail.engines.pil_engine.Engine.get_image",
+            side_effect=AssertionError("thumbnail built on request"),
+        ):
+            response = Client().get(reverse("index"))
+        self.assertContains(response, 'class="card-img"')
+
+    def test_new_post_schedules_thumbnails(self):
+        img = make_post_with_image(self, just_image=True)
+        with mock.patch("posts.views.schedule_thumbnails") as schedule:
+            self.cl_auth.post(reverse("new_post"), {"text": "withimage", "image": img})
+        schedule.assert_called_once()
+        self.assertEqual(schedule.call_args[0][0].text, "withimage")
+
+    @override_settings(THUMBNAIL_PREGENERATE_WORKERS=0)
+    def test_zero_workers_generate_inline(self):
+        post = make_post_with_image(self)
+        with mock.patch(
+            "posts.thumbnails.transaction.on_commit",
+            side_effect=lambda callback: callback(),
+        ), mock.patch("posts.thumbnails.get_executor") as get_executor:
+            schedule_thumbnails(post)
+        get_executor.assert_not_called()
+        post.refresh_from_db()
+        self.assertTrue(json.loads(post.image_variants))
+
+    def test_variants_rendered_as_srcset(self):
+        container = BytesIO()
+        Image.new("RGB", (1200, 800), "blue").save(container, format="JPEG")
+        image = SimpleUploadedFile(
+            name="wide.jpg", content=container.getvalue(), content_type="image/jpg"
+        )
+        post = Post.objects.create(author=self.user, text="wide", image=image)
+        generate_thumbnails(post.image)
+        post.refresh_from_db()
+
+        widths = sorted(
+            {variant["width"] for variant in json.loads(post.image_variants)}
+        )
+        self.assertEqual(widths, [320, 640, 960])
+        response = Client().get(reverse("index"))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, "-640.webp 640w")
+        self.assertContains(response, 'loading="lazy"')
+
+
+@skipUnless(connection.vendor == "sqlite", "FTS5 есть только в SQLite")
+class TestSearch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="12345")
+        self.other = User.objects.create_user(username="writer", password="12345")
+        self.group = Group.objects.create(title="Книги", slug="books")
+
+    def search(self, **params):
+        return Client().get(reverse("search"), params)
+
+    def test_ranks_post_text_above_comments(self):
+        in_comment = Post.objects.create(author=self.user, text="про погоду")
+        Comment.objects.create(post=in_comment, author=self.other, text="Пушкин")
+        in_text = Post.objects.create(author=self.user, text="Стихи Пушкина")
+
+        response = self.search(q="пушкин")
+        self.assertEqual(list(response.context["page"]), [in_text, in_comment])
+        self.assertContains(response, "<mark>Пушкина</mark>")
+
+    def test_filters_and_sync_on_edit_and_delete(self):
+        post = Post.objects.create(author=self.user, text="старый", group=self.group)
+        Post.objects.create(author=self.other, text="старый", group=self.group)
+        page = self.search(q="старый", author="reader").context["page"]
+        self.assertEqual(list(page), [post])
+
+        post.text = "новый"
+        post.save()
+        self.assertEqual(len(self.search(q="старый", group="books").context["page"]), 1)
+        self.assertEqual(list(self.search(q="новый").context["page"]), [post])
+        post.delete()
+        self.assertEqual(len(self.search(q="новый").context["page"]), 0)
+
+    def test_cursor_pagination_keeps_query(self):
+        posts = [
+            Post.objects.create(author=self.user, text=f"лето {'лето ' * number}")
+            for number in range(12)
+        ]
+        first = self.search(q="лето")
+        self.assertContains(first, "q=%D0%BB%D0%B5%D1%82%D0%BE&amp;cursor=")
+        second = self.search(q="лето", cursor=first.context["page"].next_cursor)
+        found = list(first.context["page"]) + list(second.context["page"])
+        self.assertCountEqual(found, posts)
+
+    def test_rebuild_command(self):
+        post = Post.objects.create(author=self.user, text="индекс")
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM posts_post_fts")
+        self.assertEqual(len(self.search(q="индекс").context["page"]), 0)
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(list(self.search(q="индекс").context["page"]), [post])
+
+    def test_fallback_matches_each_word(self):
+        post = Post.objects.create(author=self.user, text="стихи про зиму")
+        Post.objects.create(author=self.user, text="стихи про лето")
+        with mock.patch("posts.search.is_available", return_value=False):
+            page = self.search(q="зиму стихи").context["page"]
+        self.assertEqual(list(page), [post])
+
+
+class TestAdmin(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "a@a.ru", "12345")
+        self.group = Group.objects.create(title="Группа", slug="group")
+        self.client.force_login(self.admin)
+        cache.clear()
+
+    def create_posts(self, count):
+        start = Post.objects.count()
+        for number in range(start, start + count):
+            author = User.objects.create_user(f"author{number}")
+            post = Post.objects.create(
+                author=author, text=f"запись {number}", group=self.group
+            )
+            Comment.objects.create(post=post, author=author, text=f"ответ {number}")
+
+    def test_changelist_queries_do_not_grow(self):
+        self.create_posts(2)
+        for url in ("admin:posts_post_changelist", "admin:posts_comment_changelist"):
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(reverse(url))
+            self.create_posts(3)
+            cache.clear()
+            with CaptureQueriesContext(connection) as more:
+                self.assertEqual(self.client.get(reverse(url)).status_code, 200)
+            self.assertEqual(len(few), len(more))
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 есть только в SQLite")
+    def test_search_uses_full_text_index(self):
+        self.create_posts(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("admin:posts_post_changelist"), {"q": "запис 1"}
+            )
+        self.assertEqual(
+            [post.text for post in response.context["cl"].result_list], ["запись 1"]
+        )
+        self.assertTrue(any("MATCH" in query["sql"] for query in queries))
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=1)
+    @skipUnless(connection.vendor == "sqlite", "sqlite_stat1 есть только в SQLite")
+    def test_unfiltered_count_is_estimated(self):
+        self.create_posts(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE posts_post")
+        Post.objects.filter(text="запись 0").delete()
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        self.assertEqual(paginator.count, 3)
+        filtered = EstimatedCountPaginator(Post.objects.filter(group=self.group), 10)
+        self.assertEqual(filtered.count, 2)
+
+
+class TestTransfer(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user("writer", "w@w.ru", "12345")
+        self.reader = User.objects.create_user("reader", "r@r.ru", "12345")
+        self.group = Group.objects.create(title="Группа", slug="group")
+        self.post = Post.objects.create(
+            author=self.author, text="перенос", group=self.group
+        )
+        Comment.objects.create(post=self.post, author=self.reader, text="ответ")
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self):
+        out = StringIO()
+        call_command("export_posts", stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def import_file(self, dump, **options):
+        path = os.path.join(self.tmpdir, "dump.jsonl")
+        with open(path, "w", encoding="utf-8") as dump_file:
+            dump_file.write(dump)
+        call_command("import_posts", path, stdout=StringIO(), **options)
+        return path
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+        super().tearDownClass()
+
+    def test_round_trip_preserves_data(self):
+        dump = self.export()
+        pub_date = self.post.pub_date
+        Post.objects.all().delete()
+        User.objects.exclude(username="writer").delete()
+        Group.objects.all().delete()
+
+        self.import_file(dump, batch_size=1)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual(post.group.slug, "group")
+        self.assertEqual(post.author, self.author)
+        self.assertEqual(post.comments_count, 1)
+        reader = User.objects.get(username="reader")
+        self.assertFalse(reader.has_usable_password())
+        self.assertTrue(Follow.objects.filter(user=reader, author=self.author).exists())
+        self.assertEqual(UserStats.for_user(self.author).followers_count, 1)
+
+    def test_resumes_after_interruption(self):
+        dump = self.export()
+        Post.objects.all().delete()
+        with mock.patch(
+            "posts.transfer.Importer.load_comments", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.import_file(dump, batch_size=1)
+        self.assertTrue(Post.objects.filter(pk=self.post.pk).exists())
+
+        path = os.path.join(self.tmpdir, "dump.jsonl")
+        out = StringIO()
+        call_command("import_posts", path, stdout=out)
+        self.assertIn("Продолжаю с позиции", out.getvalue())
+        self.assertIn("post: 0, comment: 1, follow: 1", out.getvalue())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comments_count, 1)
+        self.assertFalse(os.path.exists(f"{path}.offset"))
+
+    def test_reimport_skips_loaded_rows(self):
+        self.import_file(self.export(), batch_size=1)
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_refuses_to_merge_into_unrelated_rows(self):
+        dump = self.export()
+        Post.objects.all().delete()
+        Post.objects.create(pk=self.post.pk, author=self.reader, text="чужая запись")
+        with self.assertRaises(CommandError):
+            self.import_file(dump)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).text, "чужая запись")
+        self.assertFalse(Comment.objects.exists())
+
+
+class TestDatabaseConfig(TestCase):
+    def test_sqlite_by_default(self):
+        database = database_from_env({}, "/srv")
+        self.assertEqual(database["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(database["NAME"], "/srv/db.sqlite3")
+
+    def test_postgresql_from_env(self):
+        database = database_from_env(
+            {
+                "DB_ENGINE": "postgresql",
+                "DB_NAME": "prod",
+                "DB_CONN_MAX_AGE": "300",
+                "DB_POOLER": "pgbouncer",
+                "DB_STATEMENT_TIMEOUT_MS": "5000",
+            }
+        )
+        self.assertEqual(database["NAME"], "prod")
+        self.assertEqual(database["CONN_MAX_AGE"], 300)
+        self.assertEqual(database["PORT"], "6432")
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+        self.assertTrue(database["DISABLE_SERVER_SIDE_CURSORS"])
+        self.assertEqual(database["OPTIONS"]["options"], "-c statement_timeout=5000")
+
+    def test_health_check_closes_dead_connection(self):
+        dead = mock.Mock(
+            settings_dict={"CONN_HEALTH_CHECKS": True}, in_atomic_block=False
+        )
+        dead.is_usable.return_value = False
+        alive = mock.Mock(
+            settings_dict={"CONN_HEALTH_CHECKS": True}, in_atomic_block=False
+        )
+        alive.is_usable.return_value = True
+        middleware = DatabaseHealthCheckMiddleware(lambda request: "response")
+        with mock.patch("yatube.db.connections.all", return_value=[dead, alive]):
+            self.assertEqual(middleware(None), "response")
+        dead.close.assert_called_once()
+        alive.close.assert_not_called()
+
+
+class TestTunedSqlite(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        reset_lock_metrics()
+
+    def connect(self, busy_timeout_ms=5000):
+        database = database_from_env(
+            {
+                "DB_SQLITE_TUNED": "true",
+                "DB_NAME": os.path.join(self.tmpdir, "tuned.sqlite3"),
+                "DB_SQLITE_BUSY_TIMEOUT_MS": str(busy_timeout_ms),
+            }
         )
+        tuned = ConnectionHandler({"default": database})["default"]
+        self.addCleanup(tuned.close)
+        return tuned
+
+    def test_pragmas_applied(self):
+        tuned = self.connect()
+        with tuned.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_writers_take_lock_at_begin(self):
+        first, second = self.connect(), self.connect(busy_timeout_ms=50)
+        first.cursor().execute("CREATE TABLE notes (text TEXT)")
+
+        first._start_transaction_under_autocommit()
+        first.cursor().execute("INSERT INTO notes VALUES ('first')")
+        with self.assertRaisesMessage(OperationalError, "locked"):
+            second._start_transaction_under_autocommit()
+        first.cursor().execute("COMMIT")
+
+        second._start_transaction_under_autocommit()
+        second.cursor().execute("COMMIT")
+        # Неудачный BEGIN прождал busy_timeout, остальные - нет
+        self.assertEqual(lock_metrics()["lock_waits"], 1)
+        self.assertGreaterEqual(lock_metrics()["max_lock_wait_seconds"], 0.04)
+
+    @override_settings(SQLITE_LOCK_RETRIES=2, SQLITE_LOCK_RETRY_DELAY=0)
+    def test_write_transaction_retries_locked_writes(self):
+        attempts = mock.Mock(
+            side_effect=[OperationalError("database is locked"), "done"]
+        )
+        with mock.patch(
+            "yatube.sqlite.connection", in_atomic_block=False
+        ), self.assertLogs("yatube.sqlite", "WARNING"):
+            self.assertEqual(write_transaction(attempts)(), "done")
+            self.assertEqual(lock_metrics()["retries"], 1)
+
+            attempts.side_effect = OperationalError("database is locked")
+            with self.assertRaises(OperationalError):
+                write_transaction(attempts)()
+        self.assertEqual(lock_metrics()["failures"], 1)
+
+    @override_settings(SQLITE_LOCK_RETRIES=2, SQLITE_LOCK_RETRY_DELAY=0)
+    def test_view_retries_only_the_write(self):
+        user = User.objects.create_user("writer", "w@w.ru", "12345")
+        self.client.force_login(user)
+        with mock.patch("posts.views.write_transaction") as transaction_:
+            self.client.get(reverse("new_post"))
+        transaction_.assert_not_called()
+
+        save = Post.save
+        failures = [OperationalError("database is locked")]
+
+        def locked_once(post, *args, **kwargs):
+            save(post, *args, **kwargs)
+            if failures:
+                raise failures.pop()
+
+        storage = Post._meta.get_field("image").storage
+        with mock.patch(
+            "yatube.sqlite.connection", in_atomic_block=False
+        ), mock.patch.object(Post, "save", locked_once), mock.patch.object(
+            storage, "save", wraps=storage.save
+        ) as store, self.assertLogs(
+            "yatube.sqlite", "WARNING"
+        ):
+            self.client.post(
+                reverse("new_post"),
+                {"text": "retried", "image": make_post_with_image(self, True)},
+            )
+        store.assert_called_once()
+        self.assertEqual(Post.objects.get(text="retried").author, user)
+
+
+class TestTwoTierCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shared = caches["shared"]
+
+    def test_hot_keys_served_from_process_memory(self):
+        cache.set("page:index", "html")
+        with mock.patch.object(self.shared, "get", side_effect=AssertionError):
+            self.assertEqual(cache.get("page:index"), "html")
+            self.assertEqual(cache.get_many(["page:index"]), {"page:index": "html"})
+
+    def test_l1_filled_from_shared_cache(self):
+        self.shared.set("card", "from another worker")
+        self.assertEqual(cache.get("card"), "from another worker")
+        self.shared.delete("card")
+        self.assertEqual(cache.get("card"), "from another worker")
+
+    def test_generations_always_read_from_shared_cache(self):
+        scope = index_scope()
+        before = get_generations([scope])
+        # Другой воркер сбросил страницы: поколение изменилось только в L2
+        self.shared.incr(GENERATION_KEY.format(scope))
+        self.assertEqual(get_generations([scope])[0], before[0] + 1)
+
+    def test_l1_is_bounded(self):
+        for number in range(cache.l1.max_entries + 10):
+            cache.set(f"key{number}", number)
+        self.assertEqual(len(cache.l1.entries), cache.l1.max_entries)
+        self.assertNotIn(cache.make_key("key0"), cache.l1.entries)
+
+    def test_file_backend_only_for_single_process(self):
+        shared = shared_cache_from_env({"CACHE_BACKEND": "file"}, "/srv")
+        self.assertEqual(shared["LOCATION"], "/srv/var/cache")
+        with self.assertRaises(ValueError):
+            shared_cache_from_env({"CACHE_BACKEND": "file", "WEB_CONCURRENCY": "4"})
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("author", "a@a.ru", "12345")
+        self.group = Group.objects.create(title="Группа", slug="group")
+        self.post = Post.objects.create(text="text", author=self.user, group=self.group)
+        self.urls = [
+            reverse("post", kwargs={"username": "author", "post_id": self.post.pk}),
+            reverse("profile", kwargs={"username": "author"}),
+            reverse("group", kwargs={"slug": "group"}),
+        ]
+        cache.clear()
+
+    def test_repeat_visit_gets_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response.has_header("Last-Modified"))
+            with self.assertNumQueries(1):
+                repeat = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(repeat.status_code, 304)
+            repeat = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+            self.assertEqual(repeat.status_code, 304)
+
+    def test_changes_produce_new_validators(self):
+        etags = [self.client.get(url)["ETag"] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.user, text="comment")
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        etag = self.client.get(self.urls[0])["ETag"]
+        self.client.force_login(self.user)
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@skipUnless(connection.vendor == "sqlite", "реплика - копия файла SQLite")
+@override_settings(DATABASE_REPLICAS=["replica"])
+class TestReplicaRouting(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("writer", "w@w.ru", "12345")
+        Post.objects.create(text="oldtext", author=self.user)
+
+        # Реплика - снимок основной базы в отдельном файле, дальше она отстает
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        replica_path = os.path.join(tmpdir, "replica.sqlite3")
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM INTO %s", [replica_path])
+        connections.databases["replica"] = {
+            **connection.settings_dict,
+            "NAME": replica_path,
+        }
+        self.addCleanup(self.drop_replica)
+        Post.objects.create(text="newtext", author=self.user)
+
+    def drop_replica(self):
+        connections["replica"].close()
+        del connections.databases["replica"]
+        delattr(connections._connections, "replica")
+
+    def test_read_only_views_use_replica(self):
+        with override_settings(DATABASE_STICKY_SECONDS=0):
+            response = self.client.get(reverse("index"))
+        self.assertContains(response, "oldtext")
+        self.assertNotContains(response, "newtext")
+        self.assertFalse(response.cookies)
+
+    def test_recent_invalidation_rebuilds_from_primary(self):
+        self.assertContains(self.client.get(reverse("index")), "newtext")
+
+    def test_writer_reads_own_writes(self):
+        self.client.force_login(self.user)
+        with override_settings(DATABASE_STICKY_SECONDS=0):
+            self.client.post(reverse("new_post"), {"text": "freshtext"})
+            self.assertNotContains(self.client.get(reverse("index")), "freshtext")
+        response = self.client.post(reverse("new_post"), {"text": "secondtext"})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        with mock.patch("posts.cache.recently_modified", return_value=False):
+            self.assertContains(self.client.get(reverse("index")), "secondtext")
+        self.assertFalse(
+            Post.objects.using("replica").filter(text="secondtext").exists()
+        )
+
+
+class TestFollowSuggestions(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(f"sugg_{name}", f"{name}@s.ru", "12345")
+            for name in "abcdefg"
+        }
+        for user, author in ("ab", "bc", "bd", "eb", "ef"):
+            self.follow(user, author)
+
+    def follow(self, user, author):
+        return Follow.objects.create(user=self.users[user], author=self.users[author])
+
+    def stored(self, name):
+        return [
+            (suggestion.author.username[5:], round(suggestion.score, 6))
+            for suggestion in FollowSuggestion.objects.filter(
+                user=self.users[name]
+            ).order_by("-score", "author_id")
+        ]
+
+    def test_rebuild_scores_friends_of_friends_and_cofollows(self):
+        call_command("compute_follow_suggestions", "--engine=python", stdout=StringIO())
+        # c и d - подписки b, f - подписка e, у которого с a общий b
+        self.assertEqual(self.stored("a"), [("c", 1), ("d", 1), ("f", 0.1)])
+        self.assertEqual(self.stored("e"), [("c", 1), ("d", 1)])
+        self.assertEqual(self.stored("c"), [])
+
+    @skipUnless(
+        suggestions.sparse is not None, "нужны зависимости из requirements-scipy.txt"
+    )
+    def test_engines_agree(self):
+        results = {}
+        for engine in suggestions.ENGINES:
+            graph = suggestions.load_graph(engine)
+            results[engine] = list(graph.top(graph.users(), 0.1, 10))
+        self.assertEqual(results["scipy"], results["python"])
+
+    def test_follow_updates_suggestions_between_rebuilds(self):
+        suggestions.rebuild("python")
+        self.follow("c", "g")
+        self.follow("a", "c")
+        self.assertEqual(self.stored("a"), [("d", 1), ("g", 1), ("f", 0.1)])
+
+        Follow.objects.filter(user=self.users["a"], author=self.users["b"]).delete()
+        self.assertEqual(self.stored("a"), [("g", 1), ("f", 0.1)])
+
+    def test_views_show_precomputed_suggestions(self):
+        suggestions.rebuild("python")
+        client = Client()
+        client.force_login(self.users["a"])
+        self.assertContains(client.get(reverse("follow_index")), "@sugg_c")
+        own_profile = reverse("profile", args=["sugg_a"])
+        self.assertContains(client.get(own_profile), "Кого почитать")
+        other_profile = reverse("profile", args=["sugg_e"])
+        self.assertNotContains(client.get(other_profile), "Кого почитать")
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("trender", "t@t.ru", "12345")
+        self.group = Group.objects.create(slug="hot", title="hot", description="d")
+        self.quiet = Post.objects.create(text="quiettext", author=self.user)
+        self.hot = Post.objects.create(
+            text="hottext", author=self.user, group=self.group
+        )
+
+    def score(self, post):
+        return PostTrend.objects.get(pk=post.pk).score
+
+    def test_comments_raise_post_and_group(self):
+        Comment.objects.create(post=self.hot, author=self.user, text="c")
+        self.assertEqual(trending.trending_posts(), [self.hot, self.quiet])
+        self.assertEqual(trending.trending_groups(), [self.group])
+        self.assertGreater(GroupTrend.objects.get(pk=self.group.pk).score, 0)
+
+    def test_older_events_weigh_less(self):
+        PostTrend.objects.all().delete()
+        now = time.time()
+        with override_settings(TRENDING_HALF_LIFE=3600):
+            trending.add(PostTrend, self.quiet.pk, 1, now - 3600)
+            trending.add(PostTrend, self.hot.pk, 1, now)
+        self.assertAlmostEqual(self.score(self.quiet) / self.score(self.hot), 0.5)
+
+    def test_compact_moves_epochs_and_drops_cold(self):
+        epoch = trending.current_epoch()
+        PostTrend.objects.filter(pk=self.hot.pk).update(epoch=epoch - 1, score=1e9)
+        PostTrend.objects.filter(pk=self.quiet.pk).update(score=1e-9)
+        call_command("compact_trending", stdout=StringIO())
+        trend = PostTrend.objects.get(pk=self.hot.pk)
+        self.assertEqual(trend.epoch, epoch)
+        self.assertAlmostEqual(
+            trend.score, 1e9 * trending.epoch_factor(epoch - 1, epoch)
+        )
+        self.assertFalse(PostTrend.objects.filter(pk=self.quiet.pk).exists())
+
+    def test_rebuild_matches_incremental_scores(self):
+        Comment.objects.create(post=self.hot, author=self.user, text="c")
+        before = dict(PostTrend.objects.values_list("pk", "score"))
+        call_command("compact_trending", "--rebuild", stdout=StringIO())
+        after = dict(PostTrend.objects.values_list("pk", "score"))
+        self.assertEqual(before.keys(), after.keys())
+        for pk, score in before.items():
+            self.assertAlmostEqual(after[pk], score)
+
+    def test_views(self):
+        response = self.client.get(reverse("trending"))
+        self.assertContains(response, "hottext")
+        self.assertContains(response, "quiettext")
+        response = self.client.get(reverse("group_trending", args=["hot"]))
+        self.assertContains(response, "hottext")
+        self.assertNotContains(response, "quiettext")
+
+
+@override_settings(COMMENTS_PER_PAGE=20)
+class TestCommentPages(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("commented", "c@c.ru", "12345")
+        self.post = Post.objects.create(text="text", author=self.user)
+        self.url = reverse("post", args=["commented", self.post.pk])
+
+    def add_comments(self, count):
+        start = User.objects.count()
+        authors = [
+            User.objects.create_user(f"commenter{number}", f"{number}@c.ru", "1")
+            for number in range(start, start + count)
+        ]
+        for number, author in enumerate(authors):
+            Comment.objects.create(post=self.post, author=author, text=f"c#{number}#")
+
+    def test_first_window_and_fragment(self):
+        self.add_comments(25)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context["comments"]), 20)
+        self.assertContains(response, "c#24#")
+        self.assertNotContains(response, "c#4#")
+        cursor = response.context["comments"].next_cursor
+
+        response = self.client.get(
+            reverse("post_comments", args=["commented", self.post.pk]),
+            {"cursor": cursor},
+        )
+        self.assertContains(response, "c#4#")
+        self.assertContains(response, "c#0#")
+        self.assertNotContains(response, "c#5#")
+        self.assertNotContains(response, "Показать еще")
+
+        response = self.client.get(self.url, {"order": "old"})
+        self.assertContains(response, "c#0#")
+        self.assertNotContains(response, "c#24#")
+
+    def test_authors_loaded_in_one_query(self):
+        self.add_comments(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self.add_comments(10)
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+        self.assertEqual(len(few), len(many))
+
+
+@override_settings(COMMENT_MAX_DEPTH=2, COMMENT_INLINE_REPLIES=2)
+class TestCommentThreads(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("threaded", "t@t.ru", "12345")
+        self.post = Post.objects.create(text="text", author=self.user)
+        self.client.force_login(self.user)
+
+    def reply(self, parent, text):
+        self.client.post(
+            reverse("add_comment", args=["threaded", self.post.pk]),
+            {"text": text, "parent": parent.pk if parent else ""},
+        )
+        return Comment.objects.get(text=text)
+
+    def test_replies_form_a_tree(self):
+        root = self.reply(None, "root")
+        child = self.reply(root, "child")
+        grandchild = self.reply(child, "grandchild")
+        # Глубже COMMENT_MAX_DEPTH ответ встает рядом с родителем
+        too_deep = self.reply(grandchild, "too deep")
+        other = self.reply(None, "other")
+
+        self.assertEqual(grandchild.path_ids(), [root.pk, child.pk, grandchild.pk])
+        self.assertEqual((too_deep.parent, too_deep.depth), (child, 2))
+        with self.assertNumQueries(1):
+            subtree = list(Comment.objects.subtrees([root]))
+        self.assertEqual(subtree, [child, grandchild, too_deep])
+        self.assertEqual(list(Comment.objects.subtrees([child, other])), subtree[1:])
+
+        root.refresh_from_db()
+        self.assertEqual(root.replies_count, 3)
+        child.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.replies_count, 0)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_post_page_shows_short_threads_inline(self):
+        short = self.reply(None, "short root")
+        self.reply(short, "short reply")
+        long = self.reply(None, "long root")
+        replies = [self.reply(long, f"long reply {number}") for number in range(3)]
+
+        response = self.client.get(reverse("post", args=["threaded", self.post.pk]))
+        self.assertContains(response, "short reply")
+        self.assertNotContains(response, "long reply")
+        replies_url = reverse(
+            "comment_replies", args=["threaded", self.post.pk, long.pk]
+        )
+        self.assertContains(response, replies_url)
+
+        with override_settings(COMMENTS_PER_PAGE=2):
+            response = self.client.get(replies_url)
+            self.assertEqual(list(response.context["replies"]), replies[:2])
+            response = self.client.get(
+                replies_url, {"cursor": response.context["replies"].next_cursor}
+            )
+        self.assertEqual(list(response.context["replies"]), replies[2:])
+
+
+class TestReactions(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user("liked", "l@l.ru", "12345")
+        self.post = Post.objects.create(text="text", author=self.author)
+        self.like_url = reverse("post_like", args=["liked", self.post.pk])
+        # TestCase не коммитит транзакции, колбэки on_commit выполняем сразу
+        patcher = mock.patch(
+            "posts.reactions.transaction.on_commit",
+            side_effect=lambda callback: callback(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def like(self, number):
+        user = User.objects.create_user(f"fan{number}", f"{number}@l.ru", "12345")
+        self.client.force_login(user)
+        self.client.post(self.like_url)
+        return user
+
+    def test_likes_spread_over_shards(self):
+        with mock.patch("posts.reactions.random.randrange", side_effect=[0, 1, 1]):
+            for number in range(3):
+                self.like(number)
+        counts = dict(
+            ReactionCounter.objects.filter(post=self.post).values_list("shard", "count")
+        )
+        self.assertEqual(counts, {0: 1, 1: 2})
+        self.assertEqual(like_totals([self.post.pk]), {self.post.pk: 3})
+
+    def test_toggle_updates_cached_total(self):
+        self.assertEqual(like_totals([self.post.pk]), {self.post.pk: 0})
+        user = self.like(0)
+        self.assertTrue(Reaction.objects.filter(user=user, post=self.post).exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(like_totals([self.post.pk]), {self.post.pk: 1})
+
+        self.client.post(self.like_url)
+        self.assertFalse(Reaction.objects.exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(like_totals([self.post.pk]), {self.post.pk: 0})
+        self.assertEqual(reactions.toggle(user, self.post), True)
+
+    def test_card_shows_total_without_count_query(self):
+        self.like(0)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("index"))
+        self.assertContains(response, "Нравится: 1")
+        self.assertFalse(
+            [query for query in queries if "COUNT(" in query["sql"].upper()]
+        )
+
+    def test_like_requires_post(self):
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(self.like_url).status_code, 405)
+        self.assertFalse(Reaction.objects.exists())
+
+    def test_likes_inside_refresh_window_reach_cached_pages(self):
+        reader = Client()
+        profile = reverse("profile", args=["liked"])
+        self.assertContains(reader.get(reverse("index")), "Нравится: 0")
+        self.assertContains(reader.get(profile), "Нравится: 0")
+        self.like(0)
+        self.assertContains(reader.get(reverse("index")), "Нравится: 1")
+        self.like(1)
+        self.like(2)
+        self.assertContains(reader.get(reverse("index")), "Нравится: 1")
+
+        # Окно PAGE_COUNTER_REFRESH закончилось
+        cache.delete_many(
+            [
+                REFRESH_KEY.format(scope)
+                for scope in (index_scope(), profile_scope("liked"))
+            ]
+        )
+        self.assertContains(reader.get(reverse("index")), "Нравится: 3")
+        self.assertContains(
+            reader.get(reverse("profile", args=["liked"])), "Нравится: 3"
+        )
+
+    def test_liker_sees_own_like_inside_refresh_window(self):
+        reader = Client()
+        self.like(0)
+        self.assertContains(reader.get(reverse("index")), "Нравится: 1")
+        fan = User.objects.create_user("fan", "fan@l.ru", "12345")
+        self.client.force_login(fan)
+        # Первый ответ выставляет CSRF-cookie, а она входит в ключ страницы
+        self.client.get(reverse("index"))
+        self.assertContains(self.client.get(reverse("index")), "Нравится: 1")
+        self.client.post(self.like_url)
+        self.assertContains(self.client.get(reverse("index")), "Нравится: 2")
+        self.assertContains(reader.get(reverse("index")), "Нравится: 1")
+
+    def test_post_etag_changes_with_likes(self):
+        url = reverse("post", args=["liked", self.post.pk])
+        reader = Client()
+        self.like(0)
+        etag = reader.get(url)["ETag"]
+        # Поколения внутри окна PAGE_COUNTER_REFRESH не меняются
+        self.like(1)
+        response = reader.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestViewCounts(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("viewed", "v@v.ru", "12345")
+        self.post = Post.objects.create(text="text", author=self.user)
+        self.url = reverse("post", args=["viewed", self.post.pk])
+        cache.clear()
+        # Свой пустой буфер: просмотры из других тестов могли еще не
+        # сброситься, а id записей в тестах повторяются. Сбрасываем его
+        # вручную, а не по окончании запросов
+        for name, value in (("_buffer", Counter()), ("_next_flush", float("inf"))):
+            patcher = mock.patch.object(view_counts, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_views_are_buffered_deduped_and_flushed(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        other = Client(HTTP_USER_AGENT="other")
+        other.get(self.url)
+        self.assertEqual(view_counts.pending(), {self.post.pk: 2})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(view_counts.flush(), 2)
+        updates = [query for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 2)
+        self.assertEqual(view_counts.pending(), {})
+        self.assertContains(self.client.get(self.url), "Просмотров: 2")
+
+    def test_failed_flush_keeps_hits(self):
+        self.client.get(self.url)
+        with mock.patch(
+            "posts.view_counts.Post.objects.filter", side_effect=OperationalError
+        ), self.assertLogs("posts.view_counts", "WARNING"):
+            self.assertEqual(view_counts.flush(), 0)
+        self.assertEqual(view_counts.pending(), {self.post.pk: 1})
+        view_counts.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 1)
+
+    def test_flush_refreshes_cached_pages(self):
+        self.assertContains(self.client.get(reverse("index")), "Просмотров: 0")
+        etag = self.client.get(self.url)["ETag"]
+        view_counts.flush()
+        self.assertContains(self.client.get(reverse("index")), "Просмотров: 1")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Просмотров: 1")
+
+    @override_settings(TESTING=False)
+    def test_flushed_on_exit(self):
+        with mock.patch("posts.apps.atexit.register") as register:
+            apps.get_app_config("posts").ready()
+        register.assert_called_once_with(view_counts.flush)
+
+
+class TestTags(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user("tagger", "t@t.ru", "12345")
+        self.reader = User.objects.create_user("reader", "r@r.ru", "12345")
+        cache.clear()
+
+    def tagged(self, post):
+        return set(post.post_tags.values_list("tag__name", flat=True))
+
+    def test_parse(self):
+        text = "#Django и #django, не тег: a#b, &#39; @reader. @nobody"
+        self.assertEqual(tags.parse_tags(text), {"django"})
+        self.assertEqual(tags.parse_mentions(text), {"reader", "nobody"})
+
+    def test_save_and_edit_reindex(self):
+        post = Post.objects.create(text="#one #two @reader @nobody", author=self.author)
+        self.assertEqual(self.tagged(post), {"one", "two"})
+        self.assertEqual(
+            list(self.reader.mentions.values_list("post", flat=True)), [post.pk]
+        )
+        self.assertEqual(Mention.objects.count(), 1)
+
+        kept = PostTag.objects.get(post=post, tag__name="two")
+        post.text = "#two #three"
+        post.save()
+        self.assertEqual(self.tagged(post), {"two", "three"})
+        self.assertTrue(PostTag.objects.filter(pk=kept.pk).exists())
+        self.assertFalse(Mention.objects.exists())
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_tag_and_mention_feeds(self):
+        posts = [
+            Post.objects.create(text=f"#feed @reader {number}", author=self.author)
+            for number in range(12)
+        ]
+        Post.objects.create(text="без тегов", author=self.author)
+        response = self.client.get(reverse("tag", args=["FEED"]))
+        page = response.context["page"]
+        self.assertEqual([post.pk for post in page], [p.pk for p in posts[:1:-1]])
+        self.assertContains(response, f'href="{reverse("tag", args=["feed"])}"')
+        response = self.client.get(
+            reverse("tag", args=["feed"]), {"cursor": page.next_cursor}
+        )
+        self.assertEqual(
+            [post.pk for post in response.context["page"]], [posts[1].pk, posts[0].pk]
+        )
+
+        response = self.client.get(reverse("mentions", args=["reader"]))
+        self.assertEqual(len(response.context["page"]), 10)
+        self.assertEqual(
+            self.client.get(reverse("tag", args=["none"])).status_code, 404
+        )
+
+    def test_backfill(self):
+        post = Post.objects.create(text="#old @reader", author=self.author)
+        PostTag.objects.all().delete()
+        Mention.objects.all().delete()
+        out = StringIO()
+        call_command("backfill_tags", chunk_size=1, stdout=out)
+        self.assertIn("Проиндексировано записей: 1", out.getvalue())
+        self.assertEqual(self.tagged(post), {"old"})
+        self.assertEqual(Mention.objects.get().user, self.reader)
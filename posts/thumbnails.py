@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import get_thumbnail
+
+from posts.cache import invalidate_post_pages
+from posts.models import Post
+from yatube.sqlite import write_transaction
+
+logger = logging.getLogger(__name__)
+
+# Должны совпадать с тегом {% thumbnail %} в include/post_card_static.html,
+# иначе шаблон не найдет готовую миниатюру и построит свою
+CARD_WIDTH, CARD_HEIGHT = 960, 339
+CARD_GEOMETRY = f"{CARD_WIDTH}x{CARD_HEIGHT}"
+CARD_OPTIONS = {"crop": "center", "upscale": True}
+
+VARIANTS_DIR = "posts/variants"
+VARIANT_SAVE_OPTIONS = {
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+}
+
+_executor = None
+
+
+def generate_thumbnails(image, post_ids=None):
+    """
+    Строит миниатюру карточки и адаптивные варианты изображения.
+    """
+    image_name = getattr(image, "name", image)
+    thumbnail = get_thumbnail(image_name, CARD_GEOMETRY, **CARD_OPTIONS)
+    posts = Post.objects.filter(image=image_name)
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    store_variants(posts, generate_variants(image_name))
+    return thumbnail
+
+
+def generate_variants(image_name):
+    with default_storage.open(image_name) as source:
+        image = Image.open(source)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    formats = [
+        image_format
+        for image_format in settings.IMAGE_VARIANT_FORMATS
+        if image_format != "webp" or features.check("webp")
+    ]
+    widths = sorted(settings.IMAGE_VARIANT_WIDTHS)
+    # Увеличивать маленькие картинки бессмысленно, хватит самого узкого варианта
+    widths = [width for width in widths if width <= image.width] or widths[:1]
+
+    variants = []
+    for width in widths:
+        height = round(width * CARD_HEIGHT / CARD_WIDTH)
+        resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        for image_format in formats:
+            buffer = BytesIO()
+            resized.save(buffer, **VARIANT_SAVE_OPTIONS[image_format])
+            name = f"{VARIANTS_DIR}/{stem}-{width}.{image_format}"
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            variants.append(
+                {"name": name, "width": width, "height": height, "format": image_format}
+            )
+    return variants
+
+
+@write_transaction
+def store_variant(post_id, variants):
+    Post.objects.filter(pk=post_id).update(
+        image_variants=json.dumps(variants), updated=timezone.now()
+    )
+
+
+def store_variants(posts, variants):
+    for post in posts:
+        store_variant(post.pk, variants)
+        invalidate_post_pages(post)
+
+
+def _generate(image_name, post_id):
+    try:
+        generate_thumbnails(image_name, [post_id])
+    except Exception:
+        logger.exception("Не удалось построить миниатюру для %s", image_name)
+
+
+def _generate_in_background(image_name, post_id):
+    try:
+        _generate(image_name, post_id)
+    finally:
+        connection.close()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_PREGENERATE_WORKERS,
+            thread_name_prefix="thumbnails",
+        )
+    return _executor
+
+
+def schedule_thumbnails(post):
+    """
+    Ставит построение миниатюр записи в фоновую очередь после коммита.
+    При THUMBNAIL_PREGENERATE_WORKERS = 0 строит их сразу в текущем потоке.
+    """
+    if not post.image:
+        return
+    image_name, post_id = post.image.name, post.pk
+    if settings.THUMBNAIL_PREGENERATE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(_generate_in_background, image_name, post_id)
+        )
+    else:
+        transaction.on_commit(lambda: _generate(image_name, post_id))
@@ -0,0 +1,214 @@
+import datetime as dt
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from posts.models import Follow, OnReadAuthor, Post, TimelineEntry, UserStats
+from posts.paginators import KeysetPaginator, after_key
+
+AUTHOR_SETS_KEY = "timeline:author_sets"
+FANOUT_BATCH_SIZE = 500
+TIMELINE_ORDERING = ("-pub_date", "-post_id")
+TIMELINE_REVERSED = ("pub_date", "post_id")
+
+
+def author_sets():
+    """
+    Авторы, чьи записи не раскладываются по лентам, и авторы, которые
+    только что перестали быть такими и ждут backfill_pending_authors.
+
+    Ожидающих дозаполнения лент по-прежнему читают напрямую, но их новые
+    записи уже раскладываются: после дозаполнения в лентах ничего не
+    пропадет.
+    """
+    sets = cache.get(AUTHOR_SETS_KEY)
+    if sets is not None:
+        return sets
+
+    popular = UserStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    ).values_list("user_id", flat=True)
+    prolific = (
+        Post.objects.filter(pub_date__gte=timezone.now() - dt.timedelta(days=1))
+        .values("author")
+        .annotate(total=Count("id"))
+        .filter(total__gt=settings.TIMELINE_FANOUT_MAX_DAILY_POSTS)
+        .values_list("author", flat=True)
+    )
+    direct = frozenset(popular) | frozenset(prolific)
+
+    sets = (direct, sync_on_read_authors(direct))
+    cache.set(AUTHOR_SETS_KEY, sets, settings.TIMELINE_ON_READ_AUTHORS_TTL)
+    return sets
+
+
+def sync_on_read_authors(direct):
+    """
+    Записывает новое множество в OnReadAuthor и возвращает авторов, которые
+    ждут дозаполнения лент. Состояние хранится в базе: потеря ключа кеша
+    или перезапуск процесса не должны оставить ленты недозаполненными.
+    """
+    current = dict(OnReadAuthor.objects.values_list("author_id", "backfill_pending"))
+    left = [
+        author_id
+        for author_id, pending in current.items()
+        if not pending and author_id not in direct
+    ]
+    returned = [author_id for author_id in direct if current.get(author_id)]
+    if left:
+        OnReadAuthor.objects.filter(author__in=left).update(backfill_pending=True)
+    if returned:
+        OnReadAuthor.objects.filter(author__in=returned).update(backfill_pending=False)
+    OnReadAuthor.objects.bulk_create(
+        [OnReadAuthor(author_id=author_id) for author_id in direct - current.keys()],
+        ignore_conflicts=True,
+    )
+    return frozenset(
+        author_id
+        for author_id, pending in current.items()
+        if (pending or author_id in left) and author_id not in direct
+    )
+
+
+def on_read_authors():
+    """
+    Авторы, чьи записи лента подписок читает напрямую.
+    """
+    direct, pending = author_sets()
+    return direct | pending
+
+
+def backfill_pending_authors():
+    """
+    Дозаполняет ленты подписчиков авторами, которых больше не читают
+    напрямую. Запускается командой rebuild_timelines --pending-authors.
+    """
+    pending = OnReadAuthor.objects.filter(backfill_pending=True).values_list(
+        "author_id", flat=True
+    )
+    done = 0
+    for author_id in list(pending):
+        backfill_author(author_id)
+        # Автор мог за это время снова попасть в множество
+        OnReadAuthor.objects.filter(author=author_id, backfill_pending=True).delete()
+        done += 1
+    cache.delete(AUTHOR_SETS_KEY)
+    return done
+
+
+def fan_out_post(post):
+    direct, _ = author_sets()
+    if post.author_id in direct:
+        return
+    followers = Follow.objects.filter(author=post.author_id).values_list(
+        "user_id", flat=True
+    )
+    entries = [
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post.id,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in followers.iterator()
+    ]
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True
+    )
+    for entry in entries:
+        if random.random() < settings.TIMELINE_TRIM_PROBABILITY:
+            trim_timeline(entry.user_id)
+
+
+def backfill(user_id, author_id):
+    direct, _ = author_sets()
+    if author_id in direct:
+        return
+    latest = Post.objects.filter(author=author_id).values_list("id", "pub_date")[
+        : settings.TIMELINE_MAX_LENGTH
+    ]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date
+            )
+            for post_id, pub_date in latest
+        ],
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timeline(user_id)
+
+
+def backfill_author(author_id):
+    followers = Follow.objects.filter(author=author_id).values_list(
+        "user_id", flat=True
+    )
+    for user_id in followers.iterator():
+        backfill(user_id, author_id)
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user=user_id, author=author_id).delete()
+
+
+def trim_timeline(user_id):
+    timeline = TimelineEntry.objects.filter(user=user_id).order_by(*TIMELINE_ORDERING)
+    oldest_kept = list(
+        timeline.values_list("pub_date", "post_id")[
+            settings.TIMELINE_MAX_LENGTH - 1 : settings.TIMELINE_MAX_LENGTH
+        ]
+    )
+    if oldest_kept:
+        timeline.filter(after_key(oldest_kept[0], TIMELINE_ORDERING)).delete()
+
+
+def rebuild_timeline(user_id):
+    TimelineEntry.objects.filter(user=user_id).delete()
+    authors = Follow.objects.filter(user=user_id).values_list("author_id", flat=True)
+    for author_id in authors:
+        backfill(user_id, author_id)
+
+
+class FollowFeedPaginator(KeysetPaginator):
+    """
+    Лента подписок: материализованная лента пользователя плюс записи
+    авторов, которые читаются напрямую.
+    """
+
+    def __init__(self, user, per_page):
+        super().__init__(Post.objects.feed(), per_page)
+        self.user = user
+
+    def _fetch(self, values, ordering):
+        limit = self.per_page + 1
+        entry_ordering = (
+            TIMELINE_ORDERING if ordering == self.ordering else TIMELINE_REVERSED
+        )
+        entries = TimelineEntry.objects.filter(user=self.user).order_by(*entry_ordering)
+        if values is not None:
+            entries = entries.filter(self._after(values, entry_ordering))
+        post_ids = list(entries.values_list("post_id", flat=True)[:limit])
+        rows = list(self.object_list.filter(pk__in=post_ids))
+
+        read_authors = on_read_authors()
+        if read_authors:
+            read_authors = list(
+                Follow.objects.filter(
+                    user=self.user, author__in=read_authors
+                ).values_list("author_id", flat=True)
+            )
+        if read_authors:
+            direct = self.object_list.filter(author__in=read_authors).order_by(
+                *ordering
+            )
+            if values is not None:
+                direct = direct.filter(self._after(values, ordering))
+            rows.extend(direct[:limit])
+
+        unique_rows = {row.id: row for row in rows}.values()
+        descending = ordering[0].startswith("-")
+        return sorted(unique_rows, key=self._sort_key, reverse=descending)[:limit]
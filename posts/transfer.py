@@ -0,0 +1,247 @@
+import json
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from posts.cache import GLOBAL_SCOPE, bump_generations
+from posts.models import PATH_SEGMENT, Comment, Follow, Group, Post, User
+
+EXPORT_CHUNK_SIZE = 2000
+
+USER_FIELDS = ("username", "first_name", "last_name", "email", "date_joined")
+GROUP_FIELDS = ("slug", "title", "description")
+POST_FIELDS = (
+    "id",
+    "text",
+    "pub_date",
+    "updated",
+    "image",
+    "image_variants",
+    "views_count",
+)
+COMMENT_FIELDS = (
+    "id",
+    "post_id",
+    "parent_id",
+    "text",
+    "created",
+    "path",
+    "depth",
+    "replies_count",
+)
+
+
+class ImportConflict(Exception):
+    pass
+
+
+def export_records():
+    """
+    Отдает записи для выгрузки по одной, не загружая таблицы в память.
+
+    Порядок моделей такой, чтобы при загрузке ссылки уже существовали.
+    """
+    for row in (
+        User.objects.order_by("pk").values(*USER_FIELDS).iterator(EXPORT_CHUNK_SIZE)
+    ):
+        yield {"model": "user", **row}
+    for row in (
+        Group.objects.order_by("pk").values(*GROUP_FIELDS).iterator(EXPORT_CHUNK_SIZE)
+    ):
+        yield {"model": "group", **row}
+    posts = Post.objects.order_by("pk").values(
+        *POST_FIELDS, author_name=F("author__username"), group_slug=F("group__slug")
+    )
+    for row in posts.iterator(EXPORT_CHUNK_SIZE):
+        yield {"model": "post", **row}
+    comments = Comment.objects.order_by("pk").values(
+        *COMMENT_FIELDS, author_name=F("author__username")
+    )
+    for row in comments.iterator(EXPORT_CHUNK_SIZE):
+        yield {"model": "comment", **row}
+    follows = Follow.objects.order_by("pk").values(
+        user_name=F("user__username"), author_name=F("author__username")
+    )
+    for row in follows.iterator(EXPORT_CHUNK_SIZE):
+        yield {"model": "follow", **row}
+
+
+def encode_value(value):
+    # В отличие от DjangoJSONEncoder сохраняем микросекунды: по дате
+    # публикации строится ключ пагинации
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def dump_record(record):
+    return json.dumps(record, default=encode_value, ensure_ascii=False)
+
+
+@contextmanager
+def preserve_timestamps(model):
+    """
+    Отключает auto_now/auto_now_add, чтобы bulk_create сохранил даты из выгрузки.
+    """
+    fields = [
+        (field, field.auto_now, field.auto_now_add)
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    for field, _, _ in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def new_rows(model, rows, fields):
+    """
+    Отбрасывает строки, которые уже загружены, и проверяет остальные id.
+
+    Строка с тем же id и теми же fields - это повтор пачки после обрыва.
+    Другая строка с тем же id - чужие данные: пропустить ее молча значило
+    бы привязать к ней комментарии из выгрузки.
+    """
+    existing = {
+        pk: values
+        for pk, *values in model.objects.filter(
+            pk__in=[row.pk for row in rows]
+        ).values_list("pk", *fields)
+    }
+    for row in rows:
+        if row.pk in existing and existing[row.pk] != [
+            getattr(row, field) for field in fields
+        ]:
+            raise ImportConflict(
+                f"{model.__name__} с id {row.pk} уже есть в базе и не совпадает "
+                "с выгрузкой, загружайте в пустую базу"
+            )
+    return [row for row in rows if row.pk not in existing]
+
+
+class Importer:
+    """
+    Загружает выгрузку пачками через bulk_create.
+
+    Авторы и группы ищутся по username и slug одним запросом на пачку,
+    записи и комментарии сохраняют свои id: на них ссылаются ответы,
+    пути комментариев и курсоры страниц. Уже загруженные записи и
+    комментарии пропускаются, поэтому после обрыва загрузку можно
+    продолжить с последней сохраненной позиции, а совпадение id с чужими
+    строками останавливает загрузку с ImportConflict.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.counts = dict.fromkeys(("user", "group", "post", "comment", "follow"), 0)
+
+    def load_batch(self, model_name, records):
+        with transaction.atomic():
+            getattr(self, f"load_{model_name}s")(records)
+        self.counts[model_name] += len(records)
+
+    def load_users(self, records):
+        users = []
+        for record in records:
+            user = User(**{field: record[field] for field in USER_FIELDS[:-1]})
+            user.date_joined = parse_datetime(record["date_joined"])
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, self.batch_size, ignore_conflicts=True)
+
+    def load_groups(self, records):
+        Group.objects.bulk_create(
+            [
+                Group(**{field: record[field] for field in GROUP_FIELDS})
+                for record in records
+            ],
+            self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def load_posts(self, records):
+        authors = self.user_ids(record["author_name"] for record in records)
+        groups = dict(
+            Group.objects.filter(
+                slug__in={record["group_slug"] for record in records}
+            ).values_list("slug", "pk")
+        )
+        posts = [
+            Post(
+                id=record["id"],
+                text=record["text"],
+                pub_date=parse_datetime(record["pub_date"]),
+                updated=parse_datetime(record["updated"]),
+                author_id=authors[record["author_name"]],
+                group_id=groups.get(record["group_slug"]),
+                image=record["image"] or "",
+                image_variants=record["image_variants"],
+                views_count=record.get("views_count", 0),
+            )
+            for record in records
+        ]
+        posts = new_rows(Post, posts, ("author_id", "pub_date", "text"))
+        with preserve_timestamps(Post):
+            Post.objects.bulk_create(posts, self.batch_size)
+
+    def load_comments(self, records):
+        authors = self.user_ids(record["author_name"] for record in records)
+        comments = [
+            Comment(
+                id=record["id"],
+                post_id=record["post_id"],
+                text=record["text"],
+                created=parse_datetime(record["created"]),
+                author_id=authors[record["author_name"]],
+                # Выгрузки до появления ответов содержат только корни
+                parent_id=record.get("parent_id"),
+                path=record.get("path") or f"{record['id']:0{PATH_SEGMENT}d}",
+                depth=record.get("depth", 0),
+                replies_count=record.get("replies_count", 0),
+            )
+            for record in records
+        ]
+        comments = new_rows(
+            Comment, comments, ("post_id", "author_id", "created", "text")
+        )
+        with preserve_timestamps(Comment):
+            Comment.objects.bulk_create(comments, self.batch_size)
+
+    def load_follows(self, records):
+        users = self.user_ids(
+            name
+            for record in records
+            for name in (record["user_name"], record["author_name"])
+        )
+        Follow.objects.bulk_create(
+            [
+                Follow(
+                    user_id=users[record["user_name"]],
+                    author_id=users[record["author_name"]],
+                )
+                for record in records
+            ],
+            self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def user_ids(self, usernames):
+        return dict(
+            User.objects.filter(username__in=set(usernames)).values_list(
+                "username", "pk"
+            )
+        )
+
+    def finish(self):
+        # Вставка шла с явными id, поэтому последовательности нужно подвинуть
+        statements = connection.ops.sequence_reset_sql(no_style(), [Post, Comment])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+        bump_generations(GLOBAL_SCOPE)
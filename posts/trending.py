@@ -0,0 +1,224 @@
+"""
+Популярные записи и группы по затухающим счетчикам.
+
+Событие весом w в момент t добавляет к счетчику w·e^{λ(t - s)}, где s -
+начало текущей эпохи. Так все счетчики эпохи затухают одинаково и их
+можно сравнивать как есть, без пересчета при каждом чтении: свежие
+события просто весят больше старых. Раз в эпоху compact_trending
+переносит счетчики в новую эпоху, умножая на e^{-λ·длина эпохи}, пока
+числа не выросли, и удаляет остывшие.
+"""
+
+import datetime as dt
+import math
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts.models import Comment, Group, GroupTrend, Post, PostTrend
+
+TRENDING_POSTS_KEY = "trending:posts:{}"
+TRENDING_GROUPS_KEY = "trending:groups"
+# Вклад старше стольких периодов полураспада меньше тысячной
+REBUILD_HALF_LIVES = 10
+
+
+def decay_rate():
+    return math.log(2) / settings.TRENDING_HALF_LIFE
+
+
+def current_epoch(now=None):
+    return int((now or time.time()) // settings.TRENDING_EPOCH_SECONDS)
+
+
+def epoch_start(epoch):
+    return epoch * settings.TRENDING_EPOCH_SECONDS
+
+
+def epoch_factor(old_epoch, new_epoch):
+    return math.exp(-decay_rate() * epoch_start(new_epoch - old_epoch))
+
+
+def weight_at(weight, when, epoch):
+    return weight * math.exp(decay_rate() * (when - epoch_start(epoch)))
+
+
+def move_to_epoch(queryset, old_epoch, new_epoch):
+    return queryset.filter(epoch=old_epoch).update(
+        epoch=new_epoch, score=F("score") * epoch_factor(old_epoch, new_epoch)
+    )
+
+
+def add(model, key, weight, when, **fields):
+    """
+    Прибавляет событие к счетчику, обычно одним UPDATE.
+    """
+    epoch = current_epoch()
+    rows = model.objects.filter(pk=key)
+    while not rows.filter(epoch=epoch).update(
+        score=F("score") + weight_at(weight, when, epoch), **fields
+    ):
+        previous = rows.values_list("epoch", flat=True).first()
+        if previous is None:
+            try:
+                with transaction.atomic():
+                    model.objects.create(
+                        pk=key,
+                        epoch=epoch,
+                        score=weight_at(weight, when, epoch),
+                        **fields
+                    )
+                return
+            except IntegrityError:
+                continue
+        # Счетчик еще не перенесли в текущую эпоху или его уже перенес
+        # процесс, у которого часы спешат
+        if previous < epoch:
+            move_to_epoch(rows, previous, epoch)
+        else:
+            epoch = previous
+
+
+def record_post(post):
+    when = post.pub_date.timestamp()
+    add(PostTrend, post.pk, settings.TRENDING_POST_WEIGHT, when, group_id=post.group_id)
+    if post.group_id is not None:
+        add(GroupTrend, post.group_id, settings.TRENDING_POST_WEIGHT, when)
+
+
+def record_comment(comment):
+    when = comment.created.timestamp()
+    group_id = comment.post.group_id
+    add(
+        PostTrend,
+        comment.post_id,
+        settings.TRENDING_COMMENT_WEIGHT,
+        when,
+        group_id=group_id,
+    )
+    if group_id is not None:
+        add(GroupTrend, group_id, settings.TRENDING_COMMENT_WEIGHT, when)
+
+
+def move_post(post):
+    PostTrend.objects.filter(pk=post.pk).update(group=post.group_id)
+
+
+def top(queryset, limit, now=None):
+    """
+    Лучшие ключи по двум последним эпохам: до сжатия часть счетчиков еще
+    лежит в прошлой эпохе. Каждая выборка - короткий проход по индексу.
+    """
+    epoch = current_epoch(now)
+    found = []
+    for previous in (epoch, epoch - 1):
+        factor = epoch_factor(previous, epoch)
+        rows = (
+            queryset.filter(epoch=previous)
+            .order_by("-score")
+            .values_list("pk", "score")[:limit]
+        )
+        found.extend((score * factor, pk) for pk, score in rows)
+    found.sort(reverse=True)
+    return [pk for _, pk in found[:limit]]
+
+
+def in_order(queryset, ids):
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def trending_posts(group=None):
+    key = TRENDING_POSTS_KEY.format(group.pk if group else "all")
+    ids = cache.get(key)
+    if ids is None:
+        trends = PostTrend.objects.all()
+        if group is not None:
+            trends = trends.filter(group=group)
+        ids = top(trends, settings.TRENDING_SIZE)
+        cache.set(key, ids, settings.TRENDING_CACHE_TIMEOUT)
+    return in_order(Post.objects.feed(), ids)
+
+
+def trending_groups():
+    ids = cache.get(TRENDING_GROUPS_KEY)
+    if ids is None:
+        ids = top(GroupTrend.objects.all(), settings.TRENDING_SIZE)
+        cache.set(TRENDING_GROUPS_KEY, ids, settings.TRENDING_CACHE_TIMEOUT)
+    return in_order(Group.objects.all(), ids)
+
+
+def compact(now=None):
+    """
+    Переносит счетчики в текущую эпоху и удаляет остывшие.
+    """
+    now = now or time.time()
+    epoch = current_epoch(now)
+    threshold = weight_at(settings.TRENDING_MIN_SCORE, now, epoch)
+    moved = deleted = 0
+    for model in (PostTrend, GroupTrend):
+        stale_epochs = (
+            model.objects.filter(epoch__lt=epoch)
+            .values_list("epoch", flat=True)
+            .distinct()
+        )
+        for previous in list(stale_epochs):
+            moved += move_to_epoch(model.objects.all(), previous, epoch)
+        deleted += model.objects.filter(epoch=epoch, score__lt=threshold).delete()[0]
+    return moved, deleted
+
+
+def rebuild(now=None):
+    """
+    Пересчитывает счетчики по записям и комментариям последних дней.
+    """
+    now = now or time.time()
+    epoch = current_epoch(now)
+    since = dt.datetime.fromtimestamp(
+        now - settings.TRENDING_HALF_LIFE * REBUILD_HALF_LIVES, timezone.utc
+    )
+    posts, groups, post_groups = defaultdict(float), defaultdict(float), {}
+    events = [
+        (
+            settings.TRENDING_POST_WEIGHT,
+            Post.objects.filter(pub_date__gte=since).values_list(
+                "pk", "group_id", "pub_date"
+            ),
+        ),
+        (
+            settings.TRENDING_COMMENT_WEIGHT,
+            Comment.objects.filter(created__gte=since).values_list(
+                "post_id", "post__group_id", "created"
+            ),
+        ),
+    ]
+    for weight, rows in events:
+        for post_id, group_id, when in rows.iterator():
+            score = weight_at(weight, when.timestamp(), epoch)
+            posts[post_id] += score
+            post_groups[post_id] = group_id
+            if group_id is not None:
+                groups[group_id] += score
+    with transaction.atomic():
+        PostTrend.objects.all().delete()
+        GroupTrend.objects.all().delete()
+        PostTrend.objects.bulk_create(
+            [
+                PostTrend(
+                    post_id=pk, group_id=post_groups[pk], epoch=epoch, score=score
+                )
+                for pk, score in posts.items()
+            ]
+        )
+        GroupTrend.objects.bulk_create(
+            [
+                GroupTrend(group_id=pk, epoch=epoch, score=score)
+                for pk, score in groups.items()
+            ]
+        )
+    return len(posts), len(groups)
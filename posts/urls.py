@@ -6,6 +6,9 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
+    path("trending/", views.trending, name="trending"),
+    path("tag/<str:name>/", views.tag_posts, name="tag"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path(
         "<str:username>/unfollow",
@@ -13,9 +16,22 @@ urlpatterns = [
         name="profile_unfollow",
     ),
     path("<str:username>/", views.profile, name="profile"),
+    path("<str:username>/mentions/", views.mentions, name="mentions"),
     path("<str:username>/<int:post_id>/", views.post_view, name="post"),
     path("<str:username>/<int:post_id>/edit/", views.post_edit, name="post_edit"),
+    path(
+        "<str:username>/<int:post_id>/comments/",
+        views.post_comments,
+        name="post_comments",
+    ),
+    path(
+        "<str:username>/<int:post_id>/comments/<int:comment_id>/replies/",
+        views.comment_replies,
+        name="comment_replies",
+    ),
     path("group/<slug:slug>/", views.group_posts, name="group"),
+    path("group/<slug:slug>/trending/", views.group_trending, name="group_trending"),
+    path("<str:username>/<int:post_id>/like/", views.post_like, name="post_like"),
     path(
         "<str:username>/<int:post_id>/comment/",
         views.add_comment,
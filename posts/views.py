@@ -1,39 +1,87 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.db.models import Count
+from django.db.models import Max, OuterRef, Subquery, Sum
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template import Context
-from django.views.decorators.cache import cache_page
-
+from django.views.decorators.http import require_POST
+
+from posts.cache import (
+    attach_post_cards,
+    bump_generations,
+    cached_page,
+    conditional_page,
+    group_scope,
+    index_scope,
+    profile_scope,
+    viewer_scope,
+)
 from posts.forms import CommentForm, NewPostForm
-from posts.models import Comment, Follow, Group, Post, User
+from posts import reactions, suggestions, view_counts
+from posts.models import (
+    PATH_SEGMENT,
+    Comment,
+    Follow,
+    Group,
+    Mention,
+    Post,
+    ReactionCounter,
+    Tag,
+    User,
+    UserStats,
+)
+from posts.paginators import KeysetPaginator
+from posts.search import SearchPaginator
+from posts.tags import IndexedFeedPaginator
+from posts.thumbnails import schedule_thumbnails
+from posts.timelines import FollowFeedPaginator
+from posts.trending import trending_groups, trending_posts
+from yatube.routers import read_replica
+from yatube.sqlite import write_transaction
 
 context = Context()
 
+COMMENT_ORDERINGS = {"new": ("-created", "-id"), "old": ("created", "id")}
+
+
 def make_paginator(request, posts, total_on_page):
-    paginator = Paginator(posts, total_on_page)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    paginator = KeysetPaginator(posts, total_on_page)
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_post_cards(page)
     return paginator, page
 
 
-def count_comments_on_page(posts):
-    all_comments = (
-        Comment.objects.values("post")
-        .filter(post__in=posts)
-        .annotate(total=Count("id"))
+def comments_page(request, post):
+    order = request.GET.get("order")
+    if order not in COMMENT_ORDERINGS:
+        order = "new"
+    paginator = KeysetPaginator(
+        post.comments.roots().select_related("author"),
+        settings.COMMENTS_PER_PAGE,
+        COMMENT_ORDERINGS[order],
     )
-    total_comments = {}
-    for post_comments in all_comments:
-        total_comments[post_comments["post"]] = post_comments["total"]
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_replies(post, page)
+    return {"comments": page, "comments_order": order}
 
-    return {"comments_on_page": total_comments}
 
+def attach_replies(post, roots):
+    """
+    Короткие ветки под корнями страницы одним запросом, длинные - по ссылке.
+    """
+    inline = [
+        root
+        for root in roots
+        if 0 < root.replies_count <= settings.COMMENT_INLINE_REPLIES
+    ]
+    threads = {}
+    for reply in post.comments.subtrees(inline).select_related("author"):
+        threads.setdefault(reply.path[:PATH_SEGMENT], []).append(reply)
+    for root in roots:
+        root.thread = threads.get(root.path, [])
 
-def count_followings(person):
-    following = person.following.count()
-    follower = person.follower.count()
-    return {"following": following, "follower": follower}
+
+def count_followings(stats):
+    return {"following": stats.followers_count, "follower": stats.following_count}
 
 
 def is_following(author, user):
@@ -44,91 +92,288 @@ def is_following(author, user):
     return {"follow": follow}
 
 
+def profile_scopes(request, username, **kwargs):
+    return [profile_scope(username)]
+
+
+def group_scopes(request, slug):
+    return [group_scope(slug)]
+
+
+def profile_validators(username):
+    return (
+        User.objects.filter(username=username)
+        .annotate(last_post=Max("posts__pub_date"))
+        .values_list("pk", "last_post")
+        .first()
+    )
+
+
+def post_validators(username, post_id, **kwargs):
+    return (
+        Post.objects.filter(pk=post_id, author__username=username)
+        .annotate(
+            last_comment=Max("comments__created"),
+            likes=Subquery(
+                ReactionCounter.objects.filter(post=OuterRef("pk"))
+                .values("post")
+                .annotate(total=Sum("count"))
+                .values("total")
+            ),
+        )
+        .values_list(
+            "updated", "comments_count", "views_count", "last_comment", "likes"
+        )
+        .first()
+    )
+
+
+def group_validators(slug):
+    return (
+        Group.objects.filter(slug=slug)
+        .annotate(last_post=Max("posts__pub_date"))
+        .values_list("pk", "posts_count", "last_post")
+        .first()
+    )
+
+
 def is_editable(author, user):
     editable = bool(user.is_authenticated and user == author)
     return {"can_edit": editable}
 
 
-@cache_page(20, key_prefix="index_page")
+@read_replica
+@cached_page(lambda request: [index_scope()])
 def index(request):
-    post_list = Post.objects.all()
+    post_list = Post.objects.feed()
     paginator, page = make_paginator(request, post_list, 10)
     context = {"page": page, "paginator": paginator}
-    context.update(count_comments_on_page(page))
 
     return render(request, "index.html", context)
 
 
 @login_required
 def follow_index(request):
-    favorites_authors_posts = Post.objects.filter(author__following__user=request.user)
-    paginator, page = make_paginator(request, favorites_authors_posts, 10)
-    context = {"page": page, "paginator": paginator}
-    context.update(count_comments_on_page(page))
+    paginator = FollowFeedPaginator(request.user, 10)
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_post_cards(page)
+    context = {
+        "page": page,
+        "paginator": paginator,
+        "suggestions": suggestions.for_user(request.user),
+    }
 
     return render(request, "follow_index.html", context)
 
 
-def profile(request, username):
+def search(request):
+    query = request.GET.get("q", "").strip()
+    group = author = None
+    if request.GET.get("group"):
+        group = get_object_or_404(Group, slug=request.GET["group"])
+    if request.GET.get("author"):
+        author = get_object_or_404(User, username=request.GET["author"])
+    paginator = SearchPaginator(query, 10, group=group, author=author)
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_post_cards(page)
+    context = {
+        "query": query,
+        "group": group,
+        "author": author,
+        "page": page,
+        "paginator": paginator,
+    }
+
+    return render(request, "search.html", context)
+
+
+@read_replica
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, name=name.lower())
+    paginator = IndexedFeedPaginator(tag.post_tags.all(), 10)
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_post_cards(page)
+    context = {"tag": tag, "page": page, "paginator": paginator}
+
+    return render(request, "tag.html", context)
+
+
+@read_replica
+def mentions(request, username):
     author = get_object_or_404(User, username=username)
-    author_posts = author.posts.all()
+    paginator = IndexedFeedPaginator(Mention.objects.filter(user=author), 10)
+    page = paginator.get_page(request.GET.get("cursor"))
+    attach_post_cards(page)
+    context = {"author": author, "page": page, "paginator": paginator}
+
+    return render(request, "mentions.html", context)
+
+
+@read_replica
+def trending(request):
+    context = {
+        "posts": attach_post_cards(trending_posts()),
+        "groups": trending_groups(),
+    }
+
+    return render(request, "trending.html", context)
+
+
+@read_replica
+def group_trending(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    context = {"group": group, "posts": attach_post_cards(trending_posts(group))}
+
+    return render(request, "group_trending.html", context)
+
+
+@read_replica
+@conditional_page(profile_scopes, profile_validators)
+@cached_page(profile_scopes)
+def profile(request, username):
+    author = get_object_or_404(User.objects.select_related("stats"), username=username)
+    stats = UserStats.for_user(author)
+    author_posts = Post.objects.feed().filter(author=author)
     paginator, page = make_paginator(request, author_posts, 10)
     context = {
         "author": author,
-        "author_posts": author.posts.count(),
+        "author_posts": stats.posts_count,
         "page": page,
         "paginator": paginator,
     }
-    context.update(count_comments_on_page(page))
-    context.update(count_followings(author))
+    context.update(count_followings(stats))
     context.update(is_editable(author, request.user))
     context.update(is_following(author, request.user))
+    if request.user == author:
+        context["suggestions"] = suggestions.for_user(request.user)
 
     return render(request, "profile.html", context)
 
 
+@read_replica
+@conditional_page(profile_scopes, post_validators)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(
+        Post.objects.feed().select_related("author__stats"),
+        author__username=username,
+        id=post_id,
+    )
+    stats = UserStats.for_user(post.author)
+    view_counts.record(request, post.pk)
+    reply_to = None
+    if request.GET.get("reply_to", "").isdigit():
+        reply_to = (
+            post.comments.select_related("author")
+            .filter(pk=request.GET["reply_to"])
+            .first()
+        )
     comment_form = CommentForm()
     context = {
         "author": post.author,
-        "author_posts": post.author.posts.count(),
-        "comments_cnt": post.comments.count(),
-        "comments": post.comments.all(),
+        "author_posts": stats.posts_count,
         "form": comment_form,
         "post": post,
+        "reply_to": reply_to,
     }
-    context.update(count_followings(post.author))
+    context.update(comments_page(request, post))
+    context.update(count_followings(stats))
     context.update(is_editable(post.author, request.user))
     context.update(is_following(post.author, request.user))
 
     return render(request, "post.html", context)
 
 
+@read_replica
+@conditional_page(profile_scopes, post_validators)
+def post_comments(request, username, post_id):
+    post = get_object_or_404(
+        Post.objects.select_related("author"), author__username=username, id=post_id
+    )
+    context = {"post": post}
+    context.update(comments_page(request, post))
+
+    return render(request, "include/comment_list.html", context)
+
+
+@read_replica
+@conditional_page(profile_scopes, post_validators)
+def comment_replies(request, username, post_id, comment_id):
+    comment = get_object_or_404(
+        Comment.objects.select_related("post__author"),
+        pk=comment_id,
+        post_id=post_id,
+        post__author__username=username,
+    )
+    paginator = KeysetPaginator(
+        Comment.objects.filter(post=post_id)
+        .subtrees([comment])
+        .select_related("author"),
+        settings.COMMENTS_PER_PAGE,
+        ("path",),
+    )
+    context = {
+        "post": comment.post,
+        "comment": comment,
+        "replies": paginator.get_page(request.GET.get("cursor")),
+    }
+
+    return render(request, "include/comment_replies.html", context)
+
+
+@read_replica
+@conditional_page(group_scopes, group_validators)
+@cached_page(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts_in_group = group.posts.all()
+    posts_in_group = Post.objects.feed().filter(group=group)
     paginator, page = make_paginator(request, posts_in_group, 10)
     context = {"group": group, "page": page, "paginator": paginator}
-    context.update(count_comments_on_page(page))
 
     return render(request, "group.html", context)
 
 
+def store_image(post):
+    # Файл пишется до транзакции: ее повтор иначе сохранял бы его заново
+    Post._meta.get_field("image").pre_save(post, add=post._state.adding)
+
+
+def save_with_retries(instance):
+    """
+    Сохраняет instance транзакцией write_transaction. Откат не возвращает
+    состояние объекта, поэтому каждая попытка начинает с исходного.
+    """
+    adding = instance._state.adding
+    fields = {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    }
+
+    @write_transaction
+    def save():
+        instance._state.adding = adding
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        instance.save()
+
+    save()
+
+
 @login_required
 def new_post(request):
     post_form = NewPostForm(request.POST or None, files=request.FILES or None)
     if post_form.is_valid():
         instance_form = post_form.save(commit=False)
         instance_form.author = request.user
-        instance_form.save()
+        store_image(instance_form)
+        save_with_retries(instance_form)
+        schedule_thumbnails(instance_form)
         return redirect("index")
     return render(request, "new_post.html", {"form": post_form})
 
 
 @login_required
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(Post.objects.feed(), author__username=username, id=post_id)
     post_form = NewPostForm(
         request.POST or None, files=request.FILES or None, instance=post
     )
@@ -136,8 +381,13 @@ def post_edit(request, username, post_id):
         return redirect("post", username=username, post_id=post_id)
 
     if post_form.is_valid():
-        post_form.author = request.user
-        post_form.save()
+        post = post_form.save(commit=False)
+        if "image" in post_form.changed_data:
+            post.image_variants = ""
+        store_image(post)
+        save_with_retries(post)
+        if "image" in post_form.changed_data:
+            schedule_thumbnails(post)
         return redirect("post", username=username, post_id=post_id)
 
     return render(request, "new_post.html", {"form": post_form, "post": post})
@@ -145,13 +395,17 @@ def post_edit(request, username, post_id):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(Post.objects.feed(), author__username=username, id=post_id)
     comment_form = CommentForm(request.POST or None)
-    if comment_form.is_valid:
+    if comment_form.is_valid():
         instance_comment = comment_form.save(commit=False)
         instance_comment.post = post
         instance_comment.author = request.user
-        instance_comment.save()
+        parent = None
+        if request.POST.get("parent", "").isdigit():
+            parent = post.comments.filter(pk=request.POST["parent"]).first()
+        instance_comment.reply_to(parent, settings.COMMENT_MAX_DEPTH)
+        save_with_retries(instance_comment)
     return redirect("post", username=username, post_id=post_id)
 
 
@@ -161,7 +415,7 @@ def profile_follow(request, username):
     previous_page = request.META.get("HTTP_REFERER", "index")
     if author == request.user:
         return redirect(previous_page)
-    Follow.objects.get_or_create(user=request.user, author=author)
+    write_transaction(Follow.objects.get_or_create)(user=request.user, author=author)
     return redirect(previous_page)
 
 
@@ -169,7 +423,19 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     previous_page = request.META.get("HTTP_REFERER", "index")
-    Follow.objects.filter(user=request.user, author=author).delete()
+    write_transaction(Follow.objects.filter(user=request.user, author=author).delete)()
+    return redirect(previous_page)
+
+
+@login_required
+@require_POST
+def post_like(request, username, post_id):
+    post = get_object_or_404(Post, author__username=username, id=post_id)
+    write_transaction(reactions.toggle)(request.user, post)
+    # Общий сброс страниц придержан окном PAGE_COUNTER_REFRESH, а сам
+    # пользователь должен сразу увидеть свой лайк
+    bump_generations(viewer_scope(request.user.pk))
+    previous_page = request.META.get("HTTP_REFERER", "index")
     return redirect(previous_page)
 
 
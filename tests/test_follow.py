@@ -3,7 +3,7 @@ import tempfile
 
 import pytest
 from django.contrib.auth import get_user_model
-from django.core.paginator import Paginator, Page
+from posts.paginators import KeysetPage, KeysetPaginator
 from django.db.models import fields
 
 try:
@@ -154,14 +154,14 @@ class TestFollow:
             "paginator" in response.context
         ), "Проверьте, что передали переменную `paginator` в контекст страницы `/follow/`"
         assert (
-            type(response.context["paginator"]) == Paginator
-        ), "Проверьте, что переменная `paginator` на странице `/follow/` типа `Paginator`"
+            isinstance(response.context["paginator"], KeysetPaginator)
+        ), "Проверьте, что переменная `paginator` на странице `/follow/` типа `KeysetPaginator`"
         assert (
             "page" in response.context
         ), "Проверьте, что передали переменную `page` в контекст страницы `/follow/`"
         assert (
-            type(response.context["page"]) == Page
-        ), "Проверьте, что переменная `page` на странице `/follow/` типа `Page`"
+            type(response.context["page"]) == KeysetPage
+        ), "Проверьте, что переменная `page` на странице `/follow/` типа `KeysetPage`"
         assert (
             len(response.context["page"]) == 2
         ), "Проверьте, что на странице `/follow/` список статей авторов на которых подписаны"
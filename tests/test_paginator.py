@@ -1,6 +1,6 @@
 import pytest
 
-from django.core.paginator import Paginator, Page
+from posts.paginators import KeysetPage, KeysetPaginator
 
 
 class TestGroupPaginatorView:
@@ -22,14 +22,14 @@ class TestGroupPaginatorView:
             "paginator" in response.context
         ), "Проверьте, что передали переменную `paginator` в контекст страницы `/group/<slug>/`"
         assert (
-            type(response.context["paginator"]) == Paginator
-        ), "Проверьте, что переменная `paginator` на странице `/group/<slug>/` типа `Paginator`"
+            type(response.context["paginator"]) == KeysetPaginator
+        ), "Проверьте, что переменная `paginator` на странице `/group/<slug>/` типа `KeysetPaginator`"
         assert (
             "page" in response.context
         ), "Проверьте, что передали переменную `page` в контекст страницы `/group/<slug>/`"
         assert (
-            type(response.context["page"]) == Page
-        ), "Проверьте, что переменная `page` на странице `/group/<slug>/` типа `Page`"
+            type(response.context["page"]) == KeysetPage
+        ), "Проверьте, что переменная `page` на странице `/group/<slug>/` типа `KeysetPage`"
 
     @pytest.mark.django_db(transaction=True)
     def test_index_paginator_view_get(self, client, post_with_group):
@@ -41,11 +41,11 @@ class TestGroupPaginatorView:
             "paginator" in response.context
         ), "Проверьте, что передали переменную `paginator` в контекст страницы `/`"
         assert (
-            type(response.context["paginator"]) == Paginator
-        ), "Проверьте, что переменная `paginator` на странице `/` типа `Paginator`"
+            type(response.context["paginator"]) == KeysetPaginator
+        ), "Проверьте, что переменная `paginator` на странице `/` типа `KeysetPaginator`"
         assert (
             "page" in response.context
         ), "Проверьте, что передали переменную `page` в контекст страницы `/`"
         assert (
-            type(response.context["page"]) == Page
-        ), "Проверьте, что переменная `page` на странице `/` типа `Page`"
+            type(response.context["page"]) == KeysetPage
+        ), "Проверьте, что переменная `page` на странице `/` типа `KeysetPage`"
@@ -0,0 +1,222 @@
+"""
+Двухуровневый кеш: маленький LRU в памяти процесса перед общим кешем.
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Общий для всех потоков процесса L1, по одному на каждый LOCATION
+_stores = {}
+_stores_lock = threading.Lock()
+
+MISSING = object()
+
+
+def shared_cache_from_env(environ=os.environ, base_dir=""):
+    """
+    Настройки общего кеша (L2) из переменных окружения.
+    """
+    backend = environ.get("CACHE_BACKEND", "locmem")
+    if backend == "locmem":
+        return {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    if backend == "file":
+        # add и incr у файлового кеша не атомарны между процессами: блокировки
+        # пересборки и счетчики поколений с ним верны только в одном процессе
+        if int(environ.get("WEB_CONCURRENCY", 1)) > 1:
+            raise ValueError(
+                "CACHE_BACKEND=file годится только для одного процесса, "
+                "для нескольких воркеров нужен memcached"
+            )
+        return {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": environ.get(
+                "CACHE_LOCATION", os.path.join(base_dir, "var", "cache")
+            ),
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        }
+    if backend == "memcached":
+        return {
+            "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+            "LOCATION": environ.get("CACHE_LOCATION", "127.0.0.1:11211"),
+        }
+    raise ValueError(f"Неизвестный CACHE_BACKEND: {backend}")
+
+
+class LocalStore:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, pickled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache(BaseCache):
+    """
+    L1 - ограниченный LRU в памяти процесса, L2 - общий кеш из LOCATION.
+
+    Записи идут в оба уровня, чтение сначала смотрит в L1. Удаление из L2
+    не доходит до L1 других процессов, поэтому в L1 держатся только
+    значения, ключ которых меняется вместе с содержимым: страницы под
+    поколениями, карточки под хешем версии. Изменяемые значения вроде
+    счетчиков поколений читаются только из L2 - их префиксы перечислены
+    в OPTIONS["L2_ONLY_PREFIXES"]. L1_TIMEOUT ограничивает, насколько
+    устаревшим может оказаться все остальное.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.l2_alias = location
+        self.l1_timeout = int(options.get("L1_TIMEOUT", 30))
+        self.l2_only_prefixes = tuple(options.get("L2_ONLY_PREFIXES", ()))
+        with _stores_lock:
+            self.l1 = _stores.setdefault(
+                location, LocalStore(int(options.get("L1_MAX_ENTRIES", 1000)))
+            )
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def l1_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def l1_allowed(self, key):
+        return not key.startswith(self.l2_only_prefixes)
+
+    def l1_timeout_for(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def remember(self, key, value, timeout, version):
+        l1_timeout = self.l1_timeout_for(timeout)
+        if self.l1_allowed(key) and l1_timeout > 0:
+            self.l1.set(self.l1_key(key, version), value, l1_timeout)
+        else:
+            self.forget(key, version)
+
+    def forget(self, key, version):
+        self.l1.delete(self.l1_key(key, version))
+
+    def get(self, key, default=None, version=None):
+        if self.l1_allowed(key):
+            value = self.l1.get(self.l1_key(key, version))
+            if value is not MISSING:
+                return value
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            return default
+        self.remember(key, value, self.l1_timeout, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, missing = {}, []
+        for key in keys:
+            value = MISSING
+            if self.l1_allowed(key):
+                value = self.l1.get(self.l1_key(key, version))
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fetched = self.l2.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self.remember(key, value, self.l1_timeout, version)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, self.resolve_timeout(timeout), version=version)
+        self.remember(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, self.resolve_timeout(timeout), version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self.remember(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, self.resolve_timeout(timeout), version=version)
+        if added:
+            self.remember(key, value, timeout, version)
+        else:
+            self.forget(key, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, self.resolve_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.forget(key, version)
+        self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.forget(key, version)
+        self.l2.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if (
+            self.l1_allowed(key)
+            and self.l1.get(self.l1_key(key, version)) is not MISSING
+        ):
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.forget(key, version)
+        return self.l2.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self.forget(key, version)
+        return self.l2.decr(key, delta, version=version)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def resolve_timeout(self, timeout):
+        return self.default_timeout if timeout == DEFAULT_TIMEOUT else timeout
@@ -0,0 +1,110 @@
+import os
+
+from django.db import connections
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def env_flag(environ, name, default):
+    return environ.get(name, str(default)).lower() in TRUE_VALUES
+
+
+def database_from_env(environ=os.environ, base_dir=""):
+    """
+    Настройки базы из переменных окружения, по умолчанию - SQLite.
+    """
+    engine = environ.get("DB_ENGINE", "sqlite3")
+    if engine in ("sqlite", "sqlite3"):
+        database = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": environ.get("DB_NAME", os.path.join(base_dir, "db.sqlite3")),
+        }
+        if env_flag(environ, "DB_SQLITE_TUNED", False):
+            database.update(tuned_sqlite(environ))
+        return database
+    if engine not in ("postgres", "postgresql"):
+        raise ValueError(f"Неизвестный DB_ENGINE: {engine}")
+
+    # С PgBouncer в режиме transaction серверные курсоры рвутся между
+    # транзакциями, а держать соединения открытыми тогда нужно до пулера
+    pooler = environ.get("DB_POOLER", "")
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": environ.get("DB_NAME", "yatube"),
+        "USER": environ.get("DB_USER", "yatube"),
+        "PASSWORD": environ.get("DB_PASSWORD", ""),
+        "HOST": environ.get("DB_HOST", "localhost"),
+        "PORT": environ.get("DB_PORT", "6432" if pooler else "5432"),
+        "CONN_MAX_AGE": int(environ.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": env_flag(environ, "DB_HEALTH_CHECKS", True),
+        "DISABLE_SERVER_SIDE_CURSORS": pooler == "pgbouncer",
+        "OPTIONS": {
+            "connect_timeout": int(environ.get("DB_CONNECT_TIMEOUT", 5)),
+            "application_name": environ.get("DB_APPLICATION_NAME", "yatube"),
+        },
+    }
+    statement_timeout = environ.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout:
+        database["OPTIONS"]["options"] = f"-c statement_timeout={statement_timeout}"
+    return database
+
+
+def replicas_from_env(environ, primary):
+    """
+    Реплики для чтения: DB_REPLICA_HOSTS для PostgreSQL, DB_REPLICA_NAMES
+    (пути к файлам) для SQLite. В тестах реплики смотрят в основную базу.
+    """
+    setting = "NAME" if "sqlite" in primary["ENGINE"] else "HOST"
+    values = environ.get(f"DB_REPLICA_{setting}S", "")
+    replicas = {}
+    for number, value in enumerate(filter(None, values.split(",")), start=1):
+        replicas[f"replica{number}"] = {
+            **primary,
+            setting: value.strip(),
+            "TEST": {"MIRROR": "default"},
+        }
+    return replicas
+
+
+def tuned_sqlite(environ):
+    # WAL пускает читателей параллельно с писателем, synchronous=NORMAL
+    # в WAL не теряет целостность, только последние транзакции при сбое
+    # питания
+    busy_timeout = int(environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", 5000))
+    return {
+        "ENGINE": "yatube.sqlite",
+        "TRANSACTION_MODE": "IMMEDIATE",
+        "PRAGMAS": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": busy_timeout,
+            "mmap_size": int(environ.get("DB_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+            "cache_size": -int(environ.get("DB_SQLITE_CACHE_KB", 64 * 1024)),
+            "temp_store": "MEMORY",
+        },
+        "OPTIONS": {"timeout": busy_timeout / 1000},
+    }
+
+
+class DatabaseHealthCheckMiddleware:
+    """
+    Перед запросом проверяет постоянные соединения и закрывает мертвые.
+
+    Без проверки соединение, которое оборвала база или пулер, всплывет
+    ошибкой в первом же запросе view. Закрытое соединение Django откроет
+    заново сам.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            if (
+                connection.settings_dict.get("CONN_HEALTH_CHECKS")
+                and connection.connection is not None
+                and not connection.in_atomic_block
+                and not connection.is_usable()
+            ):
+                connection.close()
+        return self.get_response(request)
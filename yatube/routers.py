@@ -0,0 +1,109 @@
+"""
+Чтение из реплик с привязкой к основной базе после записи.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY = "default"
+STICKY_COOKIE = "primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+# Сессии и пользователи всегда читаются из основной базы: иначе только что
+# вошедший пользователь, которого еще нет в реплике, оказался бы анонимом
+REPLICA_APP_LABELS = ("posts",)
+
+_state = threading.local()
+
+
+@contextmanager
+def _override(**values):
+    previous = {name: getattr(_state, name, False) for name in values}
+    for name, value in values.items():
+        setattr(_state, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(_state, name, value)
+
+
+def use_primary():
+    """
+    Все чтения внутри блока идут в основную базу.
+    """
+    return _override(primary=True)
+
+
+def read_replica(view):
+    """
+    Разрешает view читать из реплики, если пользователь не привязан к основной.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with _override(replica=True):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """
+    Записи идут в основную базу, чтения view с read_replica - в реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or getattr(_state, "primary", False):
+            return PRIMARY
+        if not getattr(_state, "replica", False):
+            return PRIMARY
+        if model._meta.app_label not in REPLICA_APP_LABELS:
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class PrimaryStickinessMiddleware:
+    """
+    После записи пользователь DATABASE_STICKY_SECONDS читает из основной
+    базы, чтобы сразу увидеть свои изменения, несмотря на отставание реплик.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        pinned = pinned_until > time.time() or request.method not in SAFE_METHODS
+        with _override(primary=pinned, wrote=False):
+            response = self.get_response(request)
+            wrote = _state.wrote
+        if settings.DATABASE_REPLICAS and (wrote or request.method not in SAFE_METHODS):
+            sticky = settings.DATABASE_STICKY_SECONDS
+            response.set_cookie(
+                STICKY_COOKIE,
+                str(time.time() + sticky),
+                max_age=sticky,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
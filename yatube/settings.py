@@ -11,6 +11,10 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+
+from yatube.cache import shared_cache_from_env
+from yatube.db import database_from_env, replicas_from_env
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -51,6 +55,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "yatube.db.DatabaseHealthCheckMiddleware",
+    "yatube.routers.PrimaryStickinessMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -87,12 +93,16 @@ WSGI_APPLICATION = "yatube.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# DB_ENGINE=postgresql включает PostgreSQL, остальное см. yatube/db.py
+
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
-    }
+    "default": database_from_env(os.environ, BASE_DIR),
 }
+DATABASES.update(replicas_from_env(os.environ, DATABASES["default"]))
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["yatube.routers.PrimaryReplicaRouter"]
+# Сколько секунд после записи пользователь читает только из основной базы
+DATABASE_STICKY_SECONDS = 10
 
 
 # Password validation
@@ -148,8 +158,109 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
+# default - двухуровневый кеш: LRU в памяти процесса перед общим кешем
+# shared, который видят все воркеры (CACHE_BACKEND=memcached; file - только
+# для одного процесса)
+
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+        "BACKEND": "yatube.cache.TwoTierCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": 1000,
+            "L1_TIMEOUT": 30,
+            # Изменяемые на месте значения читаются только из общего кеша
+            "L2_ONLY_PREFIXES": [
+                "page_generation:",
+                "page_lock:",
+                "timeline:",
+                "post_likes:",
+            ],
+        },
+    },
+    "shared": shared_cache_from_env(os.environ, BASE_DIR),
 }
+
+# Страницы лент сбрасываются сигналами, TTL только ограничивает память
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+# Сколько после устаревания страницу можно отдавать, пока ее пересобирают
+PAGE_CACHE_GRACE = 60
+PAGE_CACHE_LOCK_TIMEOUT = 30
+PAGE_CACHE_LOCK_WAIT = 2
+PAGE_CACHE_EARLY_EXPIRY_BETA = 1.0
+# Из-за счетчиков записи (реакций, просмотров) страницы пересобираются не
+# чаще раза в столько секунд, последнее изменение попадает на них после окна
+PAGE_COUNTER_REFRESH = 30
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Комментарии под записью выводятся порциями
+COMMENTS_PER_PAGE = 20
+# Ответы глубже COMMENT_MAX_DEPTH становятся соседями. Ветки до
+# COMMENT_INLINE_REPLIES ответов выводятся сразу, длинные - по ссылке
+COMMENT_MAX_DEPTH = 4
+COMMENT_INLINE_REPLIES = 5
+# Выше этого числа строк админка показывает оценку вместо COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 10000
+ESTIMATED_COUNT_TIMEOUT = 60
+
+# Follow feed timelines
+
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_TRIM_PROBABILITY = 0.05
+TIMELINE_FANOUT_MAX_FOLLOWERS = 5000
+TIMELINE_FANOUT_MAX_DAILY_POSTS = 100
+TIMELINE_ON_READ_AUTHORS_TTL = 300
+
+# Thumbnails
+
+# 0 - строить миниатюры сразу после коммита, без фоновых потоков. Так под
+# тестами поток не пишет в базу, пока раннер ее очищает
+TESTING = "pytest" in sys.modules or sys.argv[1:2] == ["test"]
+THUMBNAIL_PREGENERATE_WORKERS = 0 if TESTING else 2
+IMAGE_VARIANT_WIDTHS = [320, 640, 960]
+IMAGE_VARIANT_FORMATS = ["webp", "jpeg"]
+
+# SQLite write retries
+
+# Повторы записи, когда SQLite занята другим процессом, пауза растет вдвое
+SQLITE_LOCK_RETRIES = 5
+SQLITE_LOCK_RETRY_DELAY = 0.05
+# BEGIN IMMEDIATE дольше стольких секунд попадает в метрики как ожидание
+SQLITE_LOCK_WAIT_THRESHOLD = 0.005
+
+# Follow suggestions
+
+# Сколько рекомендаций хранить на пользователя и сколько показывать
+FOLLOW_SUGGESTIONS_STORED = 50
+FOLLOW_SUGGESTIONS_SHOWN = 5
+# Вес подписок похожих пользователей относительно подписок тех, на кого
+# пользователь подписан сам
+FOLLOW_SUGGESTIONS_COFOLLOW_WEIGHT = 0.1
+# Сколько подписок автора учитывается при пересчете на лету
+FOLLOW_SUGGESTIONS_FANOUT = 1000
+
+# Trending
+
+# За это время вклад комментария или записи в популярность падает вдвое
+TRENDING_HALF_LIFE = 60 * 60 * 6
+# Раз в эпоху compact_trending переносит счетчики в новую эпоху
+TRENDING_EPOCH_SECONDS = 60 * 60 * 24
+TRENDING_POST_WEIGHT = 1
+TRENDING_COMMENT_WEIGHT = 2
+# Счетчики, остывшие ниже этого значения, удаляются при сжатии
+TRENDING_MIN_SCORE = 0.05
+TRENDING_SIZE = 20
+TRENDING_CACHE_TIMEOUT = 60
+
+# Reactions
+
+# На сколько строк-шардов раскладывается счетчик реакций записи
+REACTION_COUNTER_SHARDS = 8
+REACTION_TOTAL_TIMEOUT = 60 * 5
+
+# View counts
+
+# Просмотры копятся в памяти процесса и пишутся в базу пачкой не чаще
+# раза в VIEW_COUNT_FLUSH_INTERVAL секунд, при падении процесса теряются
+VIEW_COUNT_FLUSH_INTERVAL = 10
+# Повторный просмотр той же записи в этой сессии не считается
+VIEW_COUNT_DEDUPE_SECONDS = 60 * 30
@@ -0,0 +1,97 @@
+"""
+Бэкенд SQLite для продакшена: WAL, busy_timeout и BEGIN IMMEDIATE.
+
+Включается переменной DB_SQLITE_TUNED, см. yatube/db.py.
+"""
+
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "lock_waits": 0,
+    "lock_wait_seconds": 0.0,
+    "max_lock_wait_seconds": 0.0,
+    "retries": 0,
+    "failures": 0,
+}
+
+
+def record_lock_wait(seconds):
+    # BEGIN IMMEDIATE без конкурента занимает микросекунды, ожиданием
+    # блокировки считается только то, что дольше порога
+    if seconds < settings.SQLITE_LOCK_WAIT_THRESHOLD:
+        return
+    with _metrics_lock:
+        _metrics["lock_waits"] += 1
+        _metrics["lock_wait_seconds"] += seconds
+        _metrics["max_lock_wait_seconds"] = max(
+            _metrics["max_lock_wait_seconds"], seconds
+        )
+
+
+def record_retry(failed=False):
+    with _metrics_lock:
+        _metrics["failures" if failed else "retries"] += 1
+
+
+def lock_metrics():
+    """
+    Снимок метрик ожидания блокировки записи в этом процессе.
+    """
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def reset_lock_metrics():
+    with _metrics_lock:
+        for name in _metrics:
+            _metrics[name] = type(_metrics[name])()
+
+
+def is_locked_error(error):
+    message = str(error).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def write_transaction(func):
+    """
+    Выполняет func в транзакции и повторяет ее, пока база занята.
+
+    Повторять можно только транзакцию целиком, поэтому внутри чужой
+    транзакции декоратор ничего не повторяет. Транзакция держит блокировку
+    записи с самого начала, поэтому в func должна быть только запись, без
+    рендера шаблонов и работы с файлами.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.in_atomic_block:
+            return func(*args, **kwargs)
+        delay = settings.SQLITE_LOCK_RETRY_DELAY
+        for attempt in range(settings.SQLITE_LOCK_RETRIES + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if not is_locked_error(error):
+                    raise
+                if attempt == settings.SQLITE_LOCK_RETRIES:
+                    record_retry(failed=True)
+                    raise
+                record_retry()
+                pause = delay * (2**attempt) * random.uniform(0.5, 1.5)
+                logger.warning(
+                    "База занята, повтор %s через %.3f с", attempt + 1, pause
+                )
+                time.sleep(pause)
+
+    return wrapper
@@ -0,0 +1,31 @@
+import time
+
+from django.db.backends.sqlite3 import base
+
+from yatube.sqlite import record_lock_wait
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite с прагмами из PRAGMAS и транзакциями BEGIN IMMEDIATE.
+
+    Обычный BEGIN берет блокировку записи только на первом INSERT, и если
+    ее уже держит другой процесс, SQLite сразу отвечает "database is
+    locked", не дожидаясь busy_timeout. BEGIN IMMEDIATE ждет блокировку
+    в начале транзакции, и это время попадает в метрики.
+    """
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict.get("PRAGMAS", {}).items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict.get("TRANSACTION_MODE") != "IMMEDIATE":
+            return super()._start_transaction_under_autocommit()
+        started = time.monotonic()
+        try:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        finally:
+            record_lock_wait(time.monotonic() - started)
@@ -20,10 +20,13 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from yatube.views import db_lock_metrics
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
 urlpatterns = [
+    path("admin/db-locks/", db_lock_metrics, name="db_lock_metrics"),
     path("admin/", admin.site.urls),
     path("about/", include("django.contrib.flatpages.urls")),
     path("auth/", include("users.urls")),
@@ -0,0 +1,12 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from yatube.sqlite import lock_metrics
+
+
+@staff_member_required
+def db_lock_metrics(request):
+    """
+    Метрики ожидания блокировок SQLite в процессе, который ответил.
+    """
+    return JsonResponse(lock_metrics())